@@ -0,0 +1,136 @@
+import gc
+import sys
+import time
+import tracemalloc
+
+import treeimprove as ti
+import treeimprove.s_expression.gen_tree as gen_tree
+
+def get_object_bytes(obj):
+    """Returns the size of an object and of its attribute dict (if any),
+    without following references.
+    """
+    num_bytes = sys.getsizeof(obj)
+
+    if hasattr(obj, '__dict__'):
+        num_bytes += sys.getsizeof(obj.__dict__)
+
+    return num_bytes
+
+def run(paramaters):
+    benchmark_name = paramaters['benchmark_name']
+    boolean_flag = paramaters['boolean_flag']
+
+    max_archive_size = paramaters['max_archive_size']
+    archive_tree_deapth = paramaters['archive_tree_deapth']
+
+    memory_efficient = paramaters['memory_efficient']
+    flat_trees = paramaters['flat_trees']
+
+    verbose = paramaters['verbose']
+
+    # generate problem object
+    if boolean_flag:
+        from treeimprove.problem_data.problem_data_boolean \
+            import ProblemDataBoolean
+        from treeimprove.s_expression.node import NodeBoolean \
+            as node_constructor
+
+        num_bits = paramaters['num_bits']
+        problem_data = ProblemDataBoolean(num_bits, benchmark_name)
+
+    else:
+        from treeimprove.problem_data.problem_data_integer \
+            import ProblemDataInteger
+        from treeimprove.s_expression.node import NodeInteger \
+            as node_constructor
+
+        num_bits = None
+        problem_data = ProblemDataInteger(benchmark_name)
+
+    start_time = time.time()
+    tracemalloc.start()
+
+    # unevaluated trees for archive, made one at a time as they are added
+    trees_uneval = gen_tree.iter_all_depth_trees(
+        archive_tree_deapth, problem_data, node_constructor)
+
+    # initiate archive and add trees_uneval
+    tree_archive = ti.archive.TreeArchive(
+        max_archive_size, boolean_flag=boolean_flag,
+        memory_efficient=memory_efficient, flat_trees=flat_trees)
+    num_added_trees = tree_archive.populate_archive(trees_uneval)
+
+    # drop the trees which did not make it into the archive, nodes hold
+    # reference cycles so they are only freed by the garbage collector
+    del trees_uneval
+    gc.collect()
+
+    archive_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    time_taken = time.time() - start_time
+
+    archive_size = len(tree_archive.archive)
+    num_nodes = sum(arch_tree.tree_size for arch_tree in tree_archive.archive)
+
+    # object overhead of a single node and archive entry
+    node_object_bytes = None
+    if archive_size > 0 and not flat_trees:
+        node_object_bytes = get_object_bytes(tree_archive.archive[0].tree[0])
+
+    entry_object_bytes = None
+    if archive_size > 0:
+        entry_object_bytes = get_object_bytes(tree_archive.archive[0])
+
+    results_data = {
+        'archive_bytes': archive_bytes,
+        'peak_bytes': peak_bytes,
+        'bytes_per_archive_entry': archive_bytes / max(1, archive_size),
+        'bytes_per_node': archive_bytes / max(1, num_nodes),
+
+        'node_object_bytes': node_object_bytes,
+        'entry_object_bytes': entry_object_bytes,
+
+        'num_added_trees': num_added_trees,
+        'archive_size': archive_size,
+        'num_nodes': num_nodes,
+        'time_taken': time_taken,
+
+        'max_archive_size': max_archive_size,
+        'archive_tree_deapth': archive_tree_deapth,
+        'memory_efficient': memory_efficient,
+        'flat_trees': flat_trees,
+
+        'num_bits': num_bits,
+        'benchmark_name': benchmark_name,
+    }
+
+    if verbose:
+        for key in ['archive_size', 'num_nodes', 'archive_bytes',
+            'peak_bytes', 'bytes_per_archive_entry', 'bytes_per_node',
+            'node_object_bytes', 'entry_object_bytes', 'time_taken']:
+            print(key, ': ', results_data[key])
+
+    return results_data
+
+if __name__ == '__main__':
+
+    paramaters = {
+        'num_bits': 6,
+        'benchmark_name': 'muxV',
+        'boolean_flag': True,
+
+        #'benchmark_name': 'D_A1',
+        #'boolean_flag': False,
+
+        'max_archive_size': None,
+        'archive_tree_deapth': 3,
+
+        'memory_efficient': False,
+        'flat_trees': False,
+
+        'verbose': True,
+    }
+
+    run(paramaters)
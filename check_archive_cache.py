@@ -0,0 +1,131 @@
+import random
+import shutil
+import tempfile
+
+import treeimprove as ti
+
+def get_options_key(node_data):
+    """Returns the status, archive indexes and errors of a node_data dict,
+    which must match between archives holding the same trees.
+    """
+    archtrees = node_data.get('archtrees', [])
+    if 'archtree' in node_data:
+        archtrees = [node_data['archtree']]
+
+    for key in ['better_arch_trees', 'worst_arch_trees']:
+        archtrees = node_data.get(key, archtrees)
+
+    return (node_data['status'],
+        [archtree.arch_index_pos for archtree in archtrees],
+        [archtree.tree_str for archtree in archtrees],
+        node_data.get('min_wrong'))
+
+def get_all_options(search, master_tree):
+    """Returns the options of every node of master_tree, found by each of
+    the option searches of treeimprove.improve.
+    """
+    tree_archive = search.tree_archive
+    problem_data = search.problem_data
+
+    i_nodes = list(range(len(master_tree)))
+    master_tree.ban_rules.set_master_tree_str(master_tree)
+
+    options = {
+        'smallest': [ti.improve.get_node_options_smallest(
+            i_node, master_tree, tree_archive, problem_data)
+            for i_node in i_nodes],
+
+        'batched': ti.improve.get_nodes_options_smallest(
+            i_nodes, master_tree, tree_archive, problem_data),
+    }
+
+    return {name: [get_options_key(node_data) for node_data in nodes_data]
+        for name, nodes_data in options.items()}
+
+def run(paramaters):
+    """Builds a GLTI archive, saves it to a cache, loads it again, and
+    checks that both archives give the same options for every node of
+    the master trees met over a few search steps. Returns the number of
+    nodes checked.
+    """
+    problem_type = paramaters['problem_type']
+    num_steps = paramaters['num_steps']
+
+    load_problem, boolean_flag = ti.solver.PROBLEM_TYPES[problem_type]
+    problem_data, node_constructor = load_problem(paramaters)
+
+    cache_dir = tempfile.mkdtemp()
+
+    try:
+        run_paramaters = dict(paramaters, archive_cache_dir=cache_dir)
+
+        # the first search builds and saves the archive, the second loads it
+        searches = []
+        for _ in range(2):
+            search = ti.solver.GLTISearch(run_paramaters, problem_data,
+                node_constructor, boolean_flag)
+            search.build_archive()
+            searches.append(search)
+
+    finally:
+        shutil.rmtree(cache_dir)
+
+    built_search, loaded_search = searches
+
+    master_tree = built_search.init_master_tree()
+    loaded_master_tree = loaded_search.init_master_tree()
+
+    num_checked = 0
+    for i_step in range(num_steps):
+        built_options = get_all_options(built_search, master_tree)
+        loaded_options = get_all_options(loaded_search, loaded_master_tree)
+
+        if built_options != loaded_options:
+            raise AssertionError('options differ at step {}'.format(i_step))
+
+        num_checked += len(master_tree)
+
+        if master_tree[0].wrong_count == 0:
+            break
+
+        # both steps draw the same random numbers
+        random.seed(paramaters['seed'] + i_step)
+        master_tree, _, _ = built_search.step(master_tree)
+
+        random.seed(paramaters['seed'] + i_step)
+        loaded_master_tree, _, _ = loaded_search.step(loaded_master_tree)
+
+        if str(master_tree) != str(loaded_master_tree):
+            raise AssertionError('master trees differ at step {}'.format(
+                i_step))
+
+    if paramaters['verbose']:
+        print('nodes checked : ', num_checked)
+
+    return num_checked
+
+if __name__ == '__main__':
+
+    for paramaters in [
+        {
+            'problem_type': 'boolean',
+            'num_bits': 6,
+            'benchmark_name': 'muxV',
+            'archive_tree_deapth': 3,
+        },
+        {
+            'problem_type': 'catagorical',
+            'benchmark_name': 'D_A1',
+            'archive_tree_deapth': 2,
+        },
+    ]:
+        paramaters.update({
+            'max_archive_size': None,
+            'archive_max_trees': 40000,
+            'num_steps': 10,
+            'seed': 0,
+            'verbose': True,
+        })
+
+        print(paramaters['benchmark_name'])
+        run(paramaters)
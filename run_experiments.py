@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import random
+import itertools
+import concurrent.futures
+
+import treeimprove as ti
+
+# (problem type, strategy) of each algorithm, as in the run_*.py scripts
+ALGORITHMS = {
+    'boolean_GLTI': ('boolean', 'GLTI'),
+    'boolean_LTI': ('boolean', 'LTI'),
+    'catagorical_GLTI': ('catagorical', 'GLTI'),
+    'catagorical_LTI': ('catagorical', 'LTI'),
+}
+
+def expand_grid(grid):
+    """Returns the run configurations of a grid, in order. The grid is a
+    list of blocks, each a dict of parameter name to list of values, and
+    every combination of the values of a block is a run. Each run must
+    name its 'algorithm' (a key of ALGORITHMS) and its 'seed'.
+    """
+    configs = []
+    for block in grid:
+        keys = list(block.keys())
+
+        for values in itertools.product(*[block[key] for key in keys]):
+            configs.append(dict(zip(keys, values)))
+
+    return configs
+
+def get_run_key(config):
+    """Returns the string which identifies a run configuration in the
+    results file.
+    """
+    return json.dumps(config, sort_keys=True)
+
+def load_done_keys(results_path):
+    """Returns the run keys already in the results file. A last line
+    cut short by an interruption is ignored, its run is done again.
+    """
+    done_keys = set()
+    if not os.path.exists(results_path):
+        return done_keys
+
+    with open(results_path) as results_file:
+        for line in results_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+
+            done_keys.add(record['run_key'])
+
+    # end a cut short line, so new records start on their own line
+    with open(results_path, 'rb+') as results_file:
+        results_file.seek(0, os.SEEK_END)
+
+        if results_file.tell() > 0:
+            results_file.seek(-1, os.SEEK_END)
+
+            if results_file.read(1) != b'\n':
+                results_file.write(b'\n')
+
+    return done_keys
+
+def run_config(config):
+    """Runs one configuration in a worker process and returns its
+    results record. The random module of the worker is seeded from the
+    run seed first, so each run draws its own random stream whatever
+    worker it lands on and whatever ran there before.
+    """
+    paramaters = dict(config)
+    algorithm = paramaters.pop('algorithm')
+    seed = paramaters.pop('seed')
+
+    paramaters.setdefault('verbose', False)
+
+    problem_type, strategy = ALGORITHMS[algorithm]
+
+    random.seed(seed)
+    results_data = ti.solver.solve(paramaters, problem_type, strategy)
+
+    return {
+        'run_key': get_run_key(config),
+        'config': config,
+        'results_data': results_data,
+    }
+
+def write_record(future, config, results_file, verbose):
+    """Appends the results record of a finished run to results_file.
+    Returns False if the run raised an exception, which is reported.
+    """
+    try:
+        record = future.result()
+    except Exception as error:
+        print('failed : ', get_run_key(config), repr(error))
+        return False
+
+    results_file.write(
+        json.dumps(record, default=ti.solver.json_default) + '\n')
+    results_file.flush()
+
+    if verbose:
+        results_data = record['results_data']
+        print(record['run_key'], ':',
+            None if results_data is None else
+            results_data['solution_found_flag'])
+
+    return True
+
+def run_experiments(grid, results_path, num_workers=None, verbose=True):
+    """Runs every configuration of grid (see expand_grid) not already in
+    results_path, on a pool of num_workers processes (all cores if None).
+    Each results record is appended to results_path, one json line per
+    run, as soon as the run ends, so an interrupted campaign resumes
+    where it stopped when called again.
+
+    Only num_workers runs are handed to the pool at a time. On an
+    interrupt (KeyboardInterrupt) the runs not yet started are cancelled,
+    the runs which already ended are written, and the interrupt is raised
+    again.
+
+    Runs which raise an exception are reported and left out of the
+    results file, to be tried again on the next call.
+
+    Arguments:
+    grid -- list of dicts of parameter name to list of values
+    results_path -- json lines file of results records
+    num_workers -- number of worker processes
+    verbose -- print each run as it ends.
+    """
+    configs = expand_grid(grid)
+
+    done_keys = load_done_keys(results_path)
+    todo_configs = [config for config in configs
+        if get_run_key(config) not in done_keys]
+
+    if verbose:
+        print('runs : ', len(configs), ', done : ', len(configs) - len(todo_configs))
+
+    if num_workers == None:
+        num_workers = os.cpu_count()
+
+    num_failed = 0
+
+    # future : config, of the runs handed to the pool
+    futures = {}
+    todo_configs = iter(todo_configs)
+
+    executor = concurrent.futures.ProcessPoolExecutor(num_workers)
+    with open(results_path, 'a') as results_file:
+        try:
+            while True:
+                # keep num_workers runs in the pool
+                for config in itertools.islice(
+                    todo_configs, num_workers - len(futures)):
+                    futures[executor.submit(run_config, config)] = config
+
+                if not futures:
+                    break
+
+                done, _ = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                # write in the order the runs were handed out
+                for future in [future for future in futures if future in done]:
+                    if not write_record(
+                        future, futures.pop(future), results_file, verbose):
+                        num_failed += 1
+
+        except KeyboardInterrupt:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+            # keep the runs which ended before the interrupt
+            for future, config in futures.items():
+                if future.done() and not future.cancelled():
+                    write_record(future, config, results_file, verbose)
+
+            raise
+
+    executor.shutdown()
+
+    return num_failed
+
+if __name__ == '__main__':
+
+    results_path = 'results.jsonl'
+    if len(sys.argv) > 1:
+        results_path = sys.argv[1]
+
+    seeds = list(range(30))
+
+    grid = [
+        {
+            'algorithm': ['boolean_GLTI'],
+            'benchmark_name': ['cmpV', 'majV', 'muxV', 'parV'],
+            'num_bits': [6],
+            'max_archive_size': [None],
+            'archive_tree_deapth': [3],
+            'archive_max_trees': [40000],
+            'max_time': [5000],
+            'seed': seeds,
+        },
+        {
+            'algorithm': ['boolean_LTI'],
+            'benchmark_name': ['cmpV', 'majV', 'muxV', 'parV'],
+            'num_bits': [6],
+            'max_archive_size': [450],
+            'init_master_tree_depth': [2],
+            'max_time': [5000],
+            'seed': seeds,
+        },
+        {
+            'algorithm': ['catagorical_GLTI'],
+            'benchmark_name': ['D_A1', 'D_A2', 'M_A1', 'M_A2'],
+            'max_archive_size': [None],
+            'archive_tree_deapth': [2],
+            'archive_max_trees': [40000],
+            'max_time': [5000],
+            'seed': seeds,
+        },
+        {
+            'algorithm': ['catagorical_LTI'],
+            'benchmark_name': ['D_A1', 'D_A2', 'M_A1', 'M_A2'],
+            'max_archive_size': [None],
+            'max_time': [5000],
+            'seed': seeds,
+        },
+    ]
+
+    run_experiments(grid, results_path)
@@ -7,8 +7,15 @@ Work completed as part of a 6-month internship at TAO team, INRIA, Saclay, Franc
 Internship supervisor: Marc Schoenauer (https://www.lri.fr/~marc/).
 """
 
-from . import archive
-from . import improve
-from . import select
+import importlib
 
-from . import utilities
\ No newline at end of file
+# submodules are imported on first use (ti.archive, ti.solver...), so the
+# command line (see __main__) starts without loading numpy or problem data
+SUBMODULES = ['archive', 'improve', 'select', 'parallel', 'solver', 'utilities']
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name))
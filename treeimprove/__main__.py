@@ -0,0 +1,110 @@
+"""
+Command line entry point, runs one search with treeimprove.solver.solve.
+
+    python -m treeimprove boolean GLTI muxV --num_bits 6 --seed 0
+    python -m treeimprove catagorical LTI D_A1 --results results.json
+"""
+
+import argparse
+
+# default paramaters of each (problem type, strategy), as in the run_*.py
+# scripts, overridden by the command line options
+DEFAULT_PARAMATERS = {
+    ('boolean', 'LTI'): {
+        'num_bits': 6,
+        'max_archive_size': 450,
+        'init_master_tree_depth': 2,
+    },
+    ('boolean', 'GLTI'): {
+        'num_bits': 6,
+        'max_archive_size': None,
+        'archive_tree_deapth': 3,
+        'archive_max_trees': 40000,
+    },
+    ('catagorical', 'LTI'): {
+        'max_archive_size': None,
+    },
+    ('catagorical', 'GLTI'): {
+        'max_archive_size': None,
+        'archive_tree_deapth': 2,
+        'archive_max_trees': 40000,
+    },
+}
+
+# optional integer paramaters which can be given on the command line
+INT_OPTIONS = [
+    'num_bits', 'max_archive_size', 'init_master_tree_depth',
+    'archive_tree_deapth', 'archive_max_trees', 'max_time',
+    'num_archive_workers', 'num_option_workers', 'num_archive_shards',
+    'num_search_threads',
+]
+
+def get_arg_parser():
+    """Returns the command line parser."""
+    parser = argparse.ArgumentParser(prog='python -m treeimprove',
+        description='Runs a tree improvement search on a benchmark.')
+
+    parser.add_argument('problem_type', choices=['boolean', 'catagorical'])
+    parser.add_argument('strategy', choices=['LTI', 'GLTI'])
+    parser.add_argument('benchmark_name')
+
+    for name in INT_OPTIONS:
+        parser.add_argument('--' + name, type=int)
+
+    parser.add_argument('--archive_cache_dir',
+        help='directory of saved archives (GLTI)')
+    parser.add_argument('--seed', type=int,
+        help='seed of the random module')
+    parser.add_argument('--results',
+        help='json file the results_data is written to')
+    parser.add_argument('--quiet', action='store_true')
+
+    return parser
+
+def main(argv=None):
+    parser = get_arg_parser()
+    args = parser.parse_args(argv)
+
+    paramaters = {
+        'benchmark_name': args.benchmark_name,
+        'max_time': 5000,
+        'verbose': not args.quiet,
+    }
+    paramaters.update(DEFAULT_PARAMATERS[(args.problem_type, args.strategy)])
+
+    for name in INT_OPTIONS:
+        if getattr(args, name) != None:
+            paramaters[name] = getattr(args, name)
+
+    if args.archive_cache_dir != None:
+        paramaters['archive_cache_dir'] = args.archive_cache_dir
+
+    # the solver, numpy and the problem data are only imported once the
+    # command line is parsed
+    import json
+    import random
+
+    from . import solver
+
+    # options the strategy does not support
+    try:
+        solver.STRATEGIES[args.strategy].check_paramaters(paramaters)
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.seed != None:
+        random.seed(args.seed)
+
+    results_data = solver.solve(paramaters, args.problem_type, args.strategy)
+
+    if results_data == None:
+        return 1
+
+    if args.results != None:
+        with open(args.results, 'w') as results_file:
+            json.dump(results_data, results_file, default=solver.json_default)
+
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,12 +1,26 @@
+import json
+import os
+import shutil
+import tempfile
 from collections import defaultdict
 from operator import attrgetter
 
-from bitarray import bitarray
+import numpy as np
+
+from .problem_data import problem_data_boolean
+from .problem_data import problem_data_integer
+from .s_expression.flat_tree import FlatTree, SymbolTable
+from .s_expression.node import NodeBoolean, NodeInteger
+from .s_expression.tree import Tree
+
+# bumped whenever the layout of save_cache or the archive generation changes
+ARCHIVE_CACHE_VERSION = 4
 
 class TreeForArchive(object):
     """This object serves as containers for trees
     in the archive.
     """
+    __slots__ = ('tree', 'tree_str', 'tree_size', 'arch_index_pos', 'outputs')
 
     def __init__(self, tree):
         self.tree = tree
@@ -22,6 +36,70 @@ class TreeForArchive(object):
     def __hash__(self):
         return hash(self.tree_str)
 
+class ArchiveTreeCache(object):
+    """The trees of an archive loaded by TreeArchive.load_cache, kept as
+    the saved symbol codes and child indexes until a tree is needed.
+    """
+
+    def __init__(self, codes, lefts, rights, offsets, saved_symbols,
+        problem_data, node_constructor, prepare_tree):
+        self.codes = codes
+        self.lefts = lefts
+        self.rights = rights
+        self.offsets = offsets
+
+        self.saved_symbols = saved_symbols
+        self.problem_data = problem_data
+        self.node_constructor = node_constructor
+        self.prepare_tree = prepare_tree
+
+    def build_tree(self, i_arch):
+        """Returns archive tree i_arch in the form stored by the archive."""
+        start, stop = self.offsets[i_arch:i_arch+2].tolist()
+
+        tree = Tree()
+
+        for code in self.codes[start:stop].tolist():
+            node = self.node_constructor(self.problem_data)
+            node.type, node.name, node.operator = self.saved_symbols[code]
+            tree.append(node)
+
+        for node, i_left, i_right in zip(tree,
+            self.lefts[start:stop].tolist(), self.rights[start:stop].tolist()):
+
+            if i_left >= 0:
+                node.left_child = tree[i_left]
+                node.right_child = tree[i_right]
+
+                node.left_child.parent = node
+                node.right_child.parent = node
+
+        return self.prepare_tree(tree)
+
+class CachedTreeForArchive(TreeForArchive):
+    """An archive tree loaded by TreeArchive.load_cache. Its string and
+    size are saved with the cache, its tree is only built, from an
+    ArchiveTreeCache, the first time it is used.
+    """
+    __slots__ = ('tree_cache', 'built_tree')
+
+    def __init__(self, tree_cache, arch_index_pos, tree_str, tree_size):
+        self.tree_cache = tree_cache
+        self.built_tree = None
+
+        self.tree_str = tree_str
+        self.tree_size = tree_size
+        self.arch_index_pos = arch_index_pos
+
+        self.outputs = None
+
+    @property
+    def tree(self):
+        if self.built_tree is None:
+            self.built_tree = self.tree_cache.build_tree(self.arch_index_pos)
+
+        return self.built_tree
+
 class ArchivedTreesList(list):
     """The tree archive."""
 
@@ -30,6 +108,10 @@ class ArchivedTreesList(list):
         self.memory_efficient = memory_efficient
         self.boolean_flag = boolean_flag
 
+        # hash indexes over the stored arch_trees
+        self.tree_strs = set()
+        self.outputs_positions = {}
+
     def add(self, new_archtree):
         """Adds new_archtree to the archive. Usually, this is only called from
         a TreeArchive instance.
@@ -38,59 +120,481 @@ class ArchivedTreesList(list):
 
         A larger tree within the archive which has the same outputs as new_archtree 
         is replaced by new_archtree. 
+
+        Matching trees are found through hash indexes keyed by tree string
+        and by packed output bytes, so each call is O(1) in archive size.
         """
 
-        # loop over currently stored arch_trees checking for no matching str
-        for arch_tree in self:
-            if arch_tree.tree_str == new_archtree.tree_str:
-                return False
+        # check for a stored arch_tree with matching str
+        if new_archtree.tree_str in self.tree_strs:
+            return False
 
         # evaluate tree outputs
         new_archtree.tree.calc_all_outputs()
-
-        if self.boolean_flag:
-            new_archtree.outputs = bitarray(
-                new_archtree.tree.outputs.tolist())
-        else:
-            new_archtree.outputs = list(new_archtree.tree.outputs)
+        # root outputs are shared with the tree, they are never changed in place
+        new_archtree.outputs = new_archtree.tree.outputs
 
         # clear outputs from tree nodes if memory efficient
         if self.memory_efficient:
             new_archtree.tree.clear_all_outputs()
 
-        # loop over currently stored arch_trees
-        for i_arch_tree, arch_tree in enumerate(self):
+        # check for a stored arch_tree with matching outputs
+        outputs_key = new_archtree.outputs.tobytes()
+        i_arch_tree = self.outputs_positions.get(outputs_key)
 
-            # compare outputs value-by-value
-            if arch_tree.outputs == new_archtree.outputs:
-                 
-                # outputs are equal, check for smaller size
-                if new_archtree.tree_size < arch_tree.tree_size:
-                    self[i_arch_tree] = new_archtree
-                    return True
+        if i_arch_tree is not None:
+            arch_tree = self[i_arch_tree]
 
-                # outputs were the same and size was larger or the same
-                return False
+            # outputs are equal, check for smaller size
+            if new_archtree.tree_size < arch_tree.tree_size:
+                self.tree_strs.discard(arch_tree.tree_str)
+                self.tree_strs.add(new_archtree.tree_str)
+
+                self[i_arch_tree] = new_archtree
+                return True
+
+            # outputs were the same and size was larger or the same
+            return False
+
+        self.tree_strs.add(new_archtree.tree_str)
+        self.outputs_positions[outputs_key] = len(self)
 
         self.append(new_archtree)
         return True
 
+class ExactMatchIndex(object):
+    """Bit-sliced index over the archive outputs. For each fitness case
+    the index holds packed bit slices with one bit per archive tree, set
+    when the tree gives an acceptable output for that case.
+
+    The first archive tree matching an optimals array on every case which
+    is not masked is found by AND-ing together the selected slices, one 
+    block of fitness cases at a time, stopping as soon as no candidate 
+    tree is left.
+    """
+
+    def __init__(self, trees_outputs, num_fit_tests, boolean_flag=False,
+        block_bytes=2**20):
+
+        self.num_trees = len(trees_outputs)
+        self.num_fit_tests = num_fit_tests
+        self.boolean_flag = boolean_flag
+
+        # (fitness cases x packed archive trees) bit slices
+        self.ones_slices = None
+
+        # (optimal set x fitness cases x packed archive trees) bit slices
+        self.set_slices = None
+        self.all_values_set = 0
+
+        if self.num_trees == 0:
+            self.block_size = 1
+            return
+
+        if self.boolean_flag:
+            # transpose the packed outputs a block of fitness cases at a time
+            slices = []
+            for byte_start in range(0, trees_outputs.shape[1], 512):
+                bits = np.unpackbits(
+                    trees_outputs[:, byte_start:byte_start+512], axis=1)
+                slices.append(np.packbits(bits.T, axis=1))
+
+            self.ones_slices = np.concatenate(slices)[:num_fit_tests]
+
+        else:
+            values = np.unique(trees_outputs).tolist()
+            self.all_values_set = sum(1 << value for value in values)
+
+            value_slices = {value:np.packbits(trees_outputs.T == value, axis=1) 
+                for value in values}
+
+            num_sets = self.all_values_set + 1
+            self.set_slices = np.zeros(
+                (num_sets,) + value_slices[values[0]].shape, dtype=np.uint8)
+
+            for optimal_set in range(num_sets):
+                for value in values:
+                    if optimal_set >> value & 1:
+                        self.set_slices[optimal_set] |= value_slices[value]
+
+        # number of fitness cases processed between candidate checks
+        row_bytes = (self.num_trees + 7) // 8
+        self.block_size = max(1, block_bytes // row_bytes)
+
+    def init_candidates(self, avoid_i_arch):
+        """Returns the packed set of all archive trees not in avoid_i_arch."""
+        allowed = np.ones(self.num_trees, dtype=bool)
+        allowed[[i_arch for i_arch in avoid_i_arch if i_arch is not None]] = False
+        return np.packbits(allowed)
+
+    def find_first_candidate(self, candidates, get_block_slices):
+        """AND-s candidates with the slices returned by get_block_slices
+        for each block of fitness cases. Returns the index of the first
+        remaining archive tree, or None.
+        """
+
+        for case_start in range(0, self.num_fit_tests, self.block_size):
+            block_slices = get_block_slices(case_start, case_start+self.block_size)
+
+            if len(block_slices) > 0:
+                candidates &= np.bitwise_and.reduce(block_slices, axis=0)
+
+            if not candidates.any():
+                return None
+
+        i_byte = np.flatnonzero(candidates)[0]
+        return int(8*i_byte + 8 - int(candidates[i_byte]).bit_length())
+
+    def find_first_boolean(self, optimals, optimals_mask, avoid_i_arch=()):
+        """Returns the index of the first archive tree whose outputs equal
+        optimals on all unmasked cases, or None.
+        """
+        if self.num_trees == 0:
+            return None
+
+        optimals = np.frombuffer(optimals.tobytes(), dtype=np.uint8)
+        optimals_mask = np.frombuffer(optimals_mask.tobytes(), dtype=np.uint8)
+
+        # unmasked case indexes, and a byte to flip the slices of false cases
+        unmasked = np.flatnonzero(
+            np.unpackbits(~optimals_mask)[:self.num_fit_tests])
+        flips = np.where(np.unpackbits(optimals)[unmasked], 0, 0xFF)
+        flips = flips.astype(np.uint8)[:, None]
+
+        def get_block_slices(case_start, case_stop):
+            start, stop = np.searchsorted(unmasked, [case_start, case_stop])
+            return self.ones_slices[unmasked[start:stop]] ^ flips[start:stop]
+
+        return self.find_first_candidate(
+            self.init_candidates(avoid_i_arch), get_block_slices)
+
+    def find_first_integer(self, optimal_sets, avoid_i_arch=()):
+        """Returns the index of the first archive tree whose outputs are
+        within optimal_sets for all cases, or None.
+        """
+        if self.num_trees == 0:
+            return None
+
+        optimal_sets = optimal_sets & self.all_values_set
+
+        # skip cases where every output value is acceptable
+        cared = np.flatnonzero(optimal_sets != self.all_values_set)
+
+        def get_block_slices(case_start, case_stop):
+            start, stop = np.searchsorted(cared, [case_start, case_stop])
+            i_cases = cared[start:stop]
+            return self.set_slices[optimal_sets[i_cases], i_cases]
+
+        return self.find_first_candidate(
+            self.init_candidates(avoid_i_arch), get_block_slices)
+
+class BlockedErrorCounter(object):
+    """Counts the errors of archive trees against the optimals of
+    one master tree node, a block of fitness cases at a time, so that the
+    count can be abandoned as soon as it passes a bound. Archive trees
+    are counted together in chunks under a shared bound.
+
+    Before any counting, a lower bound on the errors of every archive tree
+    in every block is worked out from the per-block output value counts
+    stored by TreeArchive.gather_tree_outputs: a tree giving value v for n
+    cases of a block, where only m cases accept v, makes at least n - m
+    errors in that block.
+    """
+
+    def __init__(self, tree_archive, mn_optimals, mn_optimals_mask=None):
+
+        self.trees_outputs = tree_archive.trees_outputs
+        self.boolean_flag = tree_archive.boolean_flag
+        block_cases = tree_archive.block_cases
+        num_fit_tests = len(mn_optimals)
+
+        self.blocks = []
+        self.remaining_bounds = np.zeros((0, 1), dtype=np.int64)
+
+        if len(self.trees_outputs) == 0:
+            return
+
+        # (value x fitness case) flags set when the case accepts the value
+        if self.boolean_flag:
+            optimals = np.frombuffer(mn_optimals.unpack(), dtype=bool)
+            optimals_mask = np.frombuffer(mn_optimals_mask.unpack(), dtype=bool)
+            accepts = np.array(
+                [~optimals | optimals_mask, optimals | optimals_mask])
+
+            self.optimals = problem_data_boolean.pack_rows([mn_optimals])[0]
+            self.cares = problem_data_boolean.pack_rows([~mn_optimals_mask])[0]
+
+            # blocks are taken over the packed bytes
+            block_size = block_cases // 8
+
+        else:
+            num_values = tree_archive.block_value_counts.shape[2]
+            accepts = np.array([(mn_optimals >> value) & 1
+                for value in range(num_values)], dtype=bool)
+
+            self.optimals = mn_optimals
+            block_size = block_cases
+
+        self.blocks = [(start, start+block_size)
+            for start in range(0, self.trees_outputs.shape[1], block_size)]
+
+        # (block x value) number of cases accepting each value
+        accept_counts = np.add.reduceat(
+            accepts.astype(np.int32), np.arange(0, num_fit_tests, block_cases),
+            axis=1).T
+
+        # (archive tree x block) lower bounds on the errors
+        block_bounds = tree_archive.block_value_counts - accept_counts
+        block_bounds = np.maximum(block_bounds, 0).sum(axis=2)
+
+        # lower bounds on the errors from each block to the end
+        self.remaining_bounds = np.zeros(
+            (len(block_bounds), len(self.blocks)+1), dtype=np.int64)
+        self.remaining_bounds[:, :-1] = np.cumsum(
+            block_bounds[:, ::-1], axis=1)[:, ::-1]
+
+    def count_block(self, outputs, start, stop):
+        """Returns the errors of each row of outputs over one block of
+        fitness cases.
+        """
+
+        if self.boolean_flag:
+            wrongs = outputs ^ self.optimals[start:stop]
+            wrongs &= self.cares[start:stop]
+            return problem_data_boolean.popcount_rows(wrongs)
+
+        output_sets = np.left_shift(1, outputs, dtype=self.optimals.dtype)
+        return np.count_nonzero(
+            (output_sets & self.optimals[start:stop]) == 0, axis=1)
+
+    def count_alive(self, start_arch, stop_arch, bound=None):
+        """Returns the archive indexes, from start_arch up to stop_arch, of
+        the archive trees whose errors are not above bound, and their errors,
+        as two numpy arrays in archive order.
+        """
+
+        if bound is None:
+            bound = float('inf')
+
+        remaining_bounds = self.remaining_bounds[start_arch:stop_arch]
+        
+        # skip archive trees whose lower bound is already too high
+        i_alive = np.flatnonzero(remaining_bounds[:, 0] <= bound)
+        count_wrongs = np.zeros(len(i_alive), dtype=np.int64)
+
+        for i_block, (start, stop) in enumerate(self.blocks):
+            if len(i_alive) == 0:
+                break
+
+            count_wrongs += self.count_block(
+                self.trees_outputs[start_arch + i_alive, start:stop],
+                start, stop)
+
+            keep = count_wrongs + remaining_bounds[i_alive, i_block+1] <= bound
+            i_alive = i_alive[keep]
+            count_wrongs = count_wrongs[keep]
+
+        return start_arch + i_alive, count_wrongs
+
+    def count_wrongs(self, start_arch, stop_arch, bound=None):
+        """Returns a list of the errors of the archive trees from start_arch
+        up to stop_arch. Entries are None for archive trees whose errors are
+        known to be above bound.
+        """
+
+        i_alive, count_wrongs = self.count_alive(start_arch, stop_arch, bound)
+
+        num_trees = len(self.remaining_bounds[start_arch:stop_arch])
+
+        all_count_wrongs = [None] * num_trees
+        for i_arch, count_wrong in zip(i_alive.tolist(), count_wrongs.tolist()):
+            all_count_wrongs[i_arch - start_arch] = count_wrong
+
+        return all_count_wrongs
+
+class NearestIndex(object):
+    """Pivot table index over the archive outputs, used to find the archive
+    trees with the fewest errors against the optimals of a master tree node
+    without counting the errors of every archive tree.
+
+    The distances (number of differing fitness cases) between every archive
+    tree and a few pivot archive trees are stored. For a query making e
+    errors with a pivot, an archive tree at distance D from that pivot
+    makes at least max(e - D, D - e - m) errors, where m is the number of 
+    query cases accepting more than one value (the masked cases in the 
+    Boolean case). Archive trees are counted in order of these lower 
+    bounds until no remaining tree can be among the nearest.
+    """
+
+    def __init__(self, trees_outputs, boolean_flag=False, num_pivots=16,
+        batch_size=64):
+
+        self.trees_outputs = trees_outputs
+        self.boolean_flag = boolean_flag
+        self.batch_size = batch_size
+
+        num_trees = len(trees_outputs)
+
+        # pick pivots one at a time, each the farthest from those picked
+        self.i_pivots = []
+        pivot_distances = []
+
+        min_distances = np.full(num_trees, np.iinfo(np.int64).max)
+        i_pivot = 0
+
+        while len(self.i_pivots) < min(num_pivots, num_trees):
+            distances = self.count_distances(self.trees_outputs[[i_pivot]])[0]
+
+            self.i_pivots.append(i_pivot)
+            pivot_distances.append(distances)
+
+            min_distances = np.minimum(min_distances, distances)
+            i_pivot = int(np.argmax(min_distances))
+
+            if min_distances[i_pivot] == 0:
+                break
+
+        # (archive tree x pivot) distances
+        self.pivot_distances = np.array(pivot_distances, dtype=np.int64).T
+
+    def count_distances(self, rows):
+        """Returns the (rows x archive trees) matrix of the number of 
+        fitness cases where each row of outputs differs from each archive
+        tree outputs.
+        """
+
+        if self.boolean_flag:
+            return problem_data_boolean.count_wrongs_matrix(
+                self.trees_outputs, rows, np.zeros_like(rows))
+
+        return problem_data_integer.count_wrongs_matrix(
+            self.trees_outputs, np.left_shift(1, rows, dtype=np.uint16))
+
+    def count_wrongs(self, i_archs, optimals_row, optimals_mask_row=None):
+        """Returns the errors of the archive trees i_archs against one
+        row of optimals, as packed by find_nearest.
+        """
+
+        if self.boolean_flag:
+            return problem_data_boolean.count_wrongs_matrix(
+                self.trees_outputs[i_archs], optimals_row, optimals_mask_row)[0]
+
+        return problem_data_integer.count_wrongs_matrix(
+            self.trees_outputs[i_archs], optimals_row)[0]
+
+    def find_nearest(self, optimals, optimals_mask=None, avoid_i_arch=(), 
+        k=1, min_wrong=0):
+        """Returns a list of (count_wrong, i_arch) tuples of the k archive
+        trees with the fewest errors against optimals, and any others tied 
+        with the k-th, sorted by errors then archive index. 
+
+        Arguments:
+        optimals -- optimals of the master tree node (bitarray in the 
+        Boolean case, array of optimal sets in the integer case)
+        optimals_mask -- mask of optimals (Boolean case only)
+        avoid_i_arch -- archive indexes which must be ignored
+        k -- number of nearest archive trees
+        min_wrong -- archive trees with fewer errors are ignored.
+        """
+
+        num_trees = len(self.trees_outputs)
+        if num_trees == 0:
+            return []
+
+        if self.boolean_flag:
+            optimals_row = problem_data_boolean.pack_rows([optimals])
+            optimals_mask_row = problem_data_boolean.pack_rows([optimals_mask])
+            num_multiple = optimals_mask.count()
+
+        else:
+            optimals_row = np.asarray(optimals)[None]
+            optimals_mask_row = None
+            num_multiple = np.count_nonzero(optimals & (optimals - 1))
+
+        # lower bounds on the errors of every archive tree
+        pivot_wrongs = self.count_wrongs(
+            self.i_pivots, optimals_row, optimals_mask_row)
+
+        lower_bounds = np.maximum(
+            pivot_wrongs - self.pivot_distances,
+            self.pivot_distances - pivot_wrongs - num_multiple).max(axis=1)
+
+        allowed = np.ones(num_trees, dtype=bool)
+        allowed[[i_arch for i_arch in avoid_i_arch if i_arch is not None]] = False
+
+        i_archs = np.flatnonzero(allowed)
+        i_archs = i_archs[np.argsort(lower_bounds[i_archs], kind='stable')]
+
+        nearest = []
+        max_wrong = float('inf')
+
+        for start in range(0, len(i_archs), self.batch_size):
+            batch = i_archs[start:start+self.batch_size]
+
+            # remaining archive trees cannot have fewer errors
+            if lower_bounds[batch[0]] > max_wrong:
+                break
+
+            count_wrongs = self.count_wrongs(
+                batch, optimals_row, optimals_mask_row)
+
+            nearest.extend((count_wrong, i_arch) for count_wrong, i_arch 
+                in zip(count_wrongs.tolist(), batch.tolist()) 
+                if count_wrong >= min_wrong)
+
+            nearest.sort()
+            if len(nearest) >= k:
+                max_wrong = nearest[k-1][0]
+                nearest = [near for near in nearest if near[0] <= max_wrong]
+
+        return nearest
+
 class TreeArchive(object):
     """This class manages the tree archive list (ArchivedTreesList)."""
 
     def __init__(self, max_archive_size, split_subtrees_flag=False, 
-        memory_efficient=False, boolean_flag=False, verbose=False):
+        memory_efficient=False, boolean_flag=False, verbose=False,
+        block_cases=4096, flat_trees=False):
 
         self.archive = ArchivedTreesList(memory_efficient, boolean_flag)
+        self.boolean_flag = boolean_flag
         
         self.max_archive_size = max_archive_size
         self.split_subtrees_flag = split_subtrees_flag
+
+        # store archive trees as FlatTree instances sharing one symbol table
+        self.flat_trees = flat_trees
+        self.symbols = None
         
         self.count_miss = 0
         self.trees_outputs = []
+        self.num_fit_tests = 0
+        self.exact_index = None
+
+        # (archive tree x block x value) output value counts per block of
+        # block_cases fitness cases (a multiple of 8), used for early abandon
+        if block_cases <= 0 or block_cases % 8 != 0:
+            raise ValueError('block_cases must be a positive multiple of 8, '
+                'got {!r}'.format(block_cases))
+
+        self.block_cases = block_cases
+        self.block_value_counts = None
+
+        # built on the first call to find_nearest
+        self.nearest_index = None
 
         self.verbose = verbose
         
+    def prepare_tree(self, tree):
+        """Returns tree in the form stored by the archive."""
+        if not self.flat_trees or isinstance(tree, FlatTree):
+            return tree
+
+        if self.symbols is None:
+            self.symbols = SymbolTable(tree.root_node.problem_data)
+
+        return FlatTree.from_tree(tree, self.symbols)
+
     def add_tree(self, tree):
         """Attempts to add tree (and all subtrees if split_subtrees_flag is True)
         into the archive.
@@ -108,7 +612,7 @@ class TreeArchive(object):
                 sub_tree = tree.get_subtree(node)
 
                 # wrap in archive container
-                arch_sub_tree = TreeForArchive(sub_tree)
+                arch_sub_tree = TreeForArchive(self.prepare_tree(sub_tree))
 
                 # add prepared sub tree to archive
                 if not self.archive.add(arch_sub_tree):
@@ -119,7 +623,7 @@ class TreeArchive(object):
 
         else:
             # wrap in archive container
-            arch_tree = TreeForArchive(tree)
+            arch_tree = TreeForArchive(self.prepare_tree(tree))
 
             # add prepared sub tree to archive
             if not self.archive.add(arch_tree):
@@ -131,19 +635,24 @@ class TreeArchive(object):
         return True
 
     def populate_archive(self, trees):
-        """Attempts to add each tree in trees into the archive."""
+        """Attempts to add each tree in trees into the archive. trees may 
+        be a generator, it is consumed one tree at a time and no further 
+        once the archive is full. Returns the number of trees added, the
+        growth of the archive (trees replacing a larger archive tree with
+        the same outputs are not counted).
+        """
 
-        num_added = 0
+        start_size = len(self.archive)
 
         # add individuals into archive
         for i_tree, tree in enumerate(trees):
             if not self.add_tree(tree):
                 break
                 
-            else:
-                num_added += 1
-                if self.verbose and i_tree%500 == 0:
-                    print('num_trees added : ', num_added)
+            if self.verbose and i_tree%500 == 0:
+                print('num_trees added : ', len(self.archive) - start_size)
+
+        num_added = len(self.archive) - start_size
 
         # convert archive into tree size sorted list
         self.archive = list(self.archive)
@@ -152,9 +661,12 @@ class TreeArchive(object):
         for i_arch_tree, arch_tree in enumerate(self.archive):
             arch_tree.arch_index_pos = i_arch_tree
 
+        return num_added
+
     def gather_tree_outputs(self):
         """Gathers each output array from each tree in the archive
-        into a single matrix.
+        into a single matrix. In the Boolean case the matrix is packed
+        into one contiguous row of bytes per tree.
         """
 
         self.trees_outputs = []
@@ -163,24 +675,265 @@ class TreeArchive(object):
             self.trees_outputs.append(arch_tree.outputs)
             arch_tree.outputs = None
 
+        num_fit_tests = 0
+        if self.trees_outputs:
+            num_fit_tests = len(self.trees_outputs[0])
+
+        if self.boolean_flag:
+            self.trees_outputs = problem_data_boolean.pack_rows(
+                self.trees_outputs)
+        else:
+            self.trees_outputs = np.array(self.trees_outputs, dtype=np.uint8)
+
+        self.build_indexes(num_fit_tests)
+
+    def build_indexes(self, num_fit_tests):
+        """Builds the search indexes over the gathered output matrix."""
+
+        self.num_fit_tests = num_fit_tests
+
+        self.exact_index = ExactMatchIndex(
+            self.trees_outputs, num_fit_tests, self.boolean_flag)
+
+        self.gather_block_value_counts(num_fit_tests)
+        self.nearest_index = None
+
+    def get_cache_path(self, cache_dir, problem_data, archive_tree_deapth,
+        max_num_trees=None):
+        """Returns the directory of the archive cache within cache_dir,
+        keyed by benchmark, number of bits, operators, archive tree depth,
+        generated tree budget, maximum archive size and split_subtrees_flag.
+        """
+
+        cache_key = '_'.join([
+            problem_data.benchmark_name,
+            'bits' + str(getattr(problem_data, 'num_bits', None)),
+            '-'.join(operator.__name__ for operator in problem_data.operators),
+            'depth' + str(archive_tree_deapth),
+            'trees' + str(max_num_trees),
+            'max' + str(self.max_archive_size),
+            'split' + str(int(self.split_subtrees_flag)),
+            'v' + str(ARCHIVE_CACHE_VERSION),
+        ])
+
+        return os.path.join(cache_dir, cache_key)
+
+    def save_cache(self, cache_dir, problem_data, archive_tree_deapth,
+        max_num_trees=None):
+        """Saves the archive (after gather_tree_outputs) into cache_dir:
+        the output matrix, each tree string, and each tree as symbol codes
+        with child indexes, kept in the tree list order. Does nothing if 
+        cache_dir is None.
+        """
+
+        if cache_dir is None:
+            return
+
+        symbols = SymbolTable(problem_data)
+        codes, lefts, rights, offsets = [], [], [], [0]
+
+        for arch_tree in self.archive:
+            tree = arch_tree.tree
+            if isinstance(tree, FlatTree):
+                tree = tree.to_tree()
+
+            i_nodes = tree.get_node_indexes()
+
+            for node in tree:
+                codes.append(symbols.get_code(node))
+
+                if node.left_child == None:
+                    lefts.append(-1)
+                    rights.append(-1)
+                else:
+                    lefts.append(i_nodes[id(node.left_child)])
+                    rights.append(i_nodes[id(node.right_child)])
+
+            offsets.append(len(codes))
+
+        cache_path = self.get_cache_path(
+            cache_dir, problem_data, archive_tree_deapth, max_num_trees)
+
+        # write into a temporary directory first so that concurrent runs
+        # never load a partly written cache
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=cache_dir)
+
+        np.save(os.path.join(tmp_path, 'outputs.npy'), self.trees_outputs)
+        np.save(os.path.join(tmp_path, 'codes.npy'), 
+            np.array(codes, dtype=np.uint16))
+        np.save(os.path.join(tmp_path, 'lefts.npy'), 
+            np.array(lefts, dtype=np.int32))
+        np.save(os.path.join(tmp_path, 'rights.npy'), 
+            np.array(rights, dtype=np.int32))
+        np.save(os.path.join(tmp_path, 'offsets.npy'), 
+            np.array(offsets, dtype=np.int64))
+
+        with open(os.path.join(tmp_path, 'tree_strs.json'), 'w') as strs_file:
+            json.dump([arch_tree.tree_str for arch_tree in self.archive], 
+                strs_file)
+
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as meta_file:
+            json.dump({
+                'symbols':[[node_type, name] 
+                    for node_type, name, _ in symbols.symbols],
+                'num_fit_tests':self.num_fit_tests,
+                'boolean_flag':self.boolean_flag,
+            }, meta_file)
+
+        try:
+            os.rename(tmp_path, cache_path)
+        except OSError:
+            # another run saved the same cache first
+            shutil.rmtree(tmp_path)
+
+    def load_cache(self, cache_dir, problem_data, archive_tree_deapth,
+        max_num_trees=None):
+        """Loads the archive saved by save_cache, if there is one, in place
+        of populate_archive and gather_tree_outputs. The output matrix is
+        memory mapped, and each tree is only built the first time it is
+        used (see CachedTreeForArchive). Returns True if the archive was 
+        loaded.
+        """
+
+        if cache_dir is None:
+            return False
+
+        cache_path = self.get_cache_path(
+            cache_dir, problem_data, archive_tree_deapth, max_num_trees)
+
+        if not os.path.isdir(cache_path):
+            return False
+
+        with open(os.path.join(cache_path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+
+        with open(os.path.join(cache_path, 'tree_strs.json')) as strs_file:
+            tree_strs = json.load(strs_file)
+
+        # map the saved symbol codes onto the problem symbols
+        symbols = SymbolTable(problem_data)
+        saved_symbols = [symbols.symbols[symbols.codes[tuple(symbol)]] 
+            for symbol in meta['symbols']]
+
+        offsets = np.load(os.path.join(cache_path, 'offsets.npy'))
+
+        if problem_data.is_boolean:
+            node_constructor = NodeBoolean
+        else:
+            node_constructor = NodeInteger
+
+        tree_cache = ArchiveTreeCache(
+            np.load(os.path.join(cache_path, 'codes.npy')),
+            np.load(os.path.join(cache_path, 'lefts.npy')),
+            np.load(os.path.join(cache_path, 'rights.npy')),
+            offsets, saved_symbols, problem_data, node_constructor,
+            self.prepare_tree)
+
+        # tree sizes are the node counts between the offsets
+        self.archive = [CachedTreeForArchive(tree_cache, i_arch, tree_str, 
+            tree_size) for i_arch, (tree_str, tree_size) in enumerate(
+            zip(tree_strs, np.diff(offsets).tolist()))]
+
+        self.trees_outputs = np.load(
+            os.path.join(cache_path, 'outputs.npy'), mmap_mode='r')
+
+        self.build_indexes(meta['num_fit_tests'])
+        return True
+
+    def gather_block_value_counts(self, num_fit_tests):
+        """Counts, for every archive tree and block of fitness cases, how
+        many times each output value is given. Used by BlockedErrorCounter.
+        """
+
+        block_starts = np.arange(0, num_fit_tests, self.block_cases)
+
+        if len(self.trees_outputs) == 0:
+            self.block_value_counts = np.zeros(
+                (0, len(block_starts), 0), dtype=np.int64)
+            return
+
+        if self.boolean_flag:
+            # count ones over the packed bytes, padding bits are zero
+            ones_counts = np.concatenate([np.add.reduceat(
+                problem_data_boolean.POPCOUNT_TABLE[trees_outputs],
+                block_starts // 8, axis=1, dtype=np.int32)
+                for trees_outputs in np.array_split(self.trees_outputs,
+                    1 + len(self.trees_outputs) // 256)])
+
+            block_lengths = np.diff(np.append(block_starts, num_fit_tests))
+            value_counts = [block_lengths - ones_counts, ones_counts]
+
+        else:
+            num_values = int(self.trees_outputs.max()) + 1
+
+            value_counts = [np.add.reduceat(
+                (self.trees_outputs == value).astype(np.int32),
+                block_starts, axis=1) for value in range(num_values)]
+
+        self.block_value_counts = np.stack(value_counts, axis=2)
+
+    def get_blocked_counter(self, mn_optimals, mn_optimals_mask=None):
+        """Returns a BlockedErrorCounter of the archive trees against the
+        optimals of one master tree node. Uses the block value counts
+        generated by gather_tree_outputs.
+        """
+        return BlockedErrorCounter(self, mn_optimals, mn_optimals_mask)
+
+    def find_perfect(self, mn_optimals, mn_optimals_mask=None, avoid_i_arch=()):
+        """Returns the index of the first (smallest) archive tree whose
+        outputs match mn_optimals on all unmasked cases, ignoring the 
+        archive indexes in avoid_i_arch. Returns None if there is no 
+        such tree. Uses the index built by gather_tree_outputs.
+        """
+
+        if self.boolean_flag:
+            return self.exact_index.find_first_boolean(
+                mn_optimals, mn_optimals_mask, avoid_i_arch)
+
+        return self.exact_index.find_first_integer(mn_optimals, avoid_i_arch)
+
+    def find_nearest(self, mn_optimals, mn_optimals_mask=None, avoid_i_arch=(),
+        k=1, min_wrong=0):
+        """Returns a list of (count_wrong, i_arch) tuples of the k archive
+        trees with the fewest errors (of at least min_wrong) against 
+        mn_optimals, and any others tied with the k-th, ignoring the 
+        archive indexes in avoid_i_arch. See NearestIndex.find_nearest.
+        """
+
+        if self.nearest_index is None:
+            self.nearest_index = NearestIndex(
+                self.trees_outputs, self.boolean_flag)
+
+        return self.nearest_index.find_nearest(mn_optimals, mn_optimals_mask,
+            avoid_i_arch, k, min_wrong)
+
     def get_all_count_wrongs(self, mn_optimals, mn_optimals_mask):
         """Calculates errors from all trees in the library using
         the output marix generated by gather_tree_outputs.
         """
 
-        wrong_counts = [0]*len(self.trees_outputs)
+        return self.get_count_wrongs_matrix(
+            [mn_optimals], [mn_optimals_mask])[0].tolist()
 
-        # loop over all archive trees
-        for i_tree, tree_outputs in enumerate(self.trees_outputs):
-            
-            # loop over all master tree node optimal values
-            for optimal, mask, tree_output in zip(
-                mn_optimals, mn_optimals_mask, tree_outputs):
+    def get_count_wrongs_matrix(self, mn_optimals, mn_optimals_masks=None):
+        """Calculates errors from all trees in the library for several
+        master tree nodes at once. Uses the output matrix generated by 
+        gather_tree_outputs.
 
-                if mask:
-                    continue
+        Arguments:
+        mn_optimals -- list of optimal arrays, one per master tree node
+        mn_optimals_masks -- list of the matching optimal masks 
+        (Boolean case only).
 
-                if optimal != tree_output:
-                    wrong_counts[i_tree] += 1
+        Returns a (nodes x archive trees) numpy matrix of error counts.
+        """
+
+        if self.boolean_flag:
+            return problem_data_boolean.count_wrongs_matrix(
+                self.trees_outputs,
+                problem_data_boolean.pack_rows(mn_optimals),
+                problem_data_boolean.pack_rows(mn_optimals_masks))
 
-        return wrong_counts
+        return problem_data_integer.count_wrongs_matrix(
+            self.trees_outputs, np.array(mn_optimals))
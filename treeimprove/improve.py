@@ -1,6 +1,9 @@
-import copy
+import numpy as np
 
+from .problem_data import problem_data_boolean
+from .problem_data import problem_data_integer
 from .s_expression.tree import Tree
+from .s_expression.flat_tree import FlatTree
 
 # status flags for performance of sets of archive trees
 STATUS_PERFECT = 0
@@ -8,6 +11,9 @@ STATUS_BETTER = 1
 STATUS_WORST = 2
 STATUS_NONE = 3
 
+# number of archive trees counted together by the early abandon mode
+EARLY_ABANDON_CHUNK = 256
+
 def get_subtree_i_nodes(tree, sub_i_root):
     """Given a tree and the index position of a subtree root 
     node within that tree, returns the indexes of all nodes 
@@ -16,6 +22,7 @@ def get_subtree_i_nodes(tree, sub_i_root):
 
     sub_tree_i_nodes = set([])
     to_explore = [sub_i_root]
+    i_nodes = tree.get_node_indexes()
 
     # loop while there are still nodes to explore
     while len(to_explore) > 0:
@@ -26,8 +33,8 @@ def get_subtree_i_nodes(tree, sub_i_root):
         if tree[i_node].left_child == None:
             continue
 
-        left_i_node = tree.index(tree[i_node].left_child)
-        right_i_node = tree.index(tree[i_node].right_child)
+        left_i_node = i_nodes[id(tree[i_node].left_child)]
+        right_i_node = i_nodes[id(tree[i_node].right_child)]
 
         to_explore.append(left_i_node)
         to_explore.append(right_i_node)
@@ -39,12 +46,16 @@ def subtree_crossover(master_tree, i_node, insert_tree):
     index postion i_node of master_tree.
     """
 
-    # create copy of archive tree to be inserted
-    to_add_tree = copy.deepcopy(insert_tree)
+    # create copy of archive tree to be inserted, sharing output arrays
+    if isinstance(insert_tree, FlatTree):
+        to_add_tree = insert_tree.to_tree()
+    else:
+        to_add_tree = insert_tree.copy()
 
+    # master_tree is changed in place below and replaced by the new tree,
+    # so its ban rules are handed over rather than copied
     if i_node == 0:
-        to_add_tree.ban_rules = copy.deepcopy(
-            master_tree.ban_rules)
+        to_add_tree.ban_rules = master_tree.ban_rules
         return to_add_tree, to_add_tree[0]
 
     to_remove_root = master_tree[i_node]
@@ -62,8 +73,10 @@ def subtree_crossover(master_tree, i_node, insert_tree):
     to_remove_i_nodes = get_subtree_i_nodes(master_tree, i_node)
 
     new_master_tree = Tree()
-    new_master_tree.ban_rules = \
-        copy.deepcopy(master_tree.ban_rules)
+    new_master_tree.ban_rules = master_tree.ban_rules
+
+    # carried over until the new master tree is re-evaluated
+    new_master_tree.total_wrongs = master_tree.total_wrongs
 
     for idx, node in enumerate(master_tree):
         if idx in to_remove_i_nodes:
@@ -89,17 +102,33 @@ def update_master_tree(master_tree, i_node, archtree):
 
     orig_master_tree_str = str(master_tree)
 
+    # record the removed subtree for the incremental re-evaluation
+    removed_i_nodes = get_subtree_i_nodes(master_tree, i_node)
+    removed_wrongs = sum(master_tree[i_removed].wrong_count 
+        for i_removed in removed_i_nodes)
+
+    # node counts are not always calculated before the first update
+    counted_below = master_tree.root_node.nodes_below_count == len(master_tree)
+
     # generate new tree
     master_tree, new_subroot_node = subtree_crossover(
         master_tree, i_node, archtree.tree)
 
     # re-evaluate master_tree
-    master_tree.calc_outputs_up(new_subroot_node)
-    master_tree.calc_all_optimals()
+    if new_subroot_node.parent == None:
+        master_tree.calc_outputs_up(new_subroot_node)
+        master_tree.calc_all_optimals()
 
-    master_tree.calc_nodes_count_wrongs()
-    master_tree.calc_nodes_count_twos()
-    master_tree.calc_nodes_count_nodes_below()
+        master_tree.calc_nodes_count_wrongs()
+        master_tree.calc_nodes_count_twos()
+        master_tree.calc_nodes_count_nodes_below()
+
+    else:
+        master_tree.calc_all_after_insert(
+            new_subroot_node, len(removed_i_nodes), removed_wrongs)
+
+        if not counted_below:
+            master_tree.calc_nodes_count_nodes_below()
 
     # record archtree on banned list for that (i_node, tree)
     master_tree.ban_rules.add_rule(
@@ -112,35 +141,15 @@ def count_wrong_boolean(mn_optimals, mn_optimals_mask, outputs):
     an optimal array and an output array.
     """
 
-    wrong_count = 0
-    for optimal, mask, output in zip(
-        mn_optimals, mn_optimals_mask, outputs):
-        
-        if mask:
-            continue
-        if optimal != output:
-            wrong_count += 1
-    return wrong_count
+    return problem_data_boolean.count_wrongs(
+        outputs, mn_optimals, mn_optimals_mask)
 
 def count_wrong_integer(optimals, outputs):
     """Calculates the number of errors for the finite algebra (integer) 
-    case when given an optimal array and an output array.
+    case when given an optimal sets array and an output array.
     """
 
-    wrong_count = 0
-    for i in range(len(optimals)):
-        optimal = optimals[i]
-        out = outputs[i]
-
-        if isinstance(optimal, tuple):
-            if out not in optimal:
-                wrong_count += 1
-
-        else:
-            if out != optimal:
-                wrong_count += 1
-
-    return wrong_count
+    return problem_data_integer.count_wrongs(outputs, optimals)
 
 def get_node_options(i_node, master_tree, tree_archive, problem_data):
     """Returns the possible options for replacing the node."""
@@ -160,19 +169,34 @@ def get_node_options(i_node, master_tree, tree_archive, problem_data):
     # dict of node data
     node_data = {}
 
+    # check for perfect answer through the archive exact match index
+    i_perfect = tree_archive.find_perfect(
+        node.optimals, node.optimals_mask, avoid_i_arch)
+
+    if i_perfect is not None:
+        archtree = tree_archive.archive[i_perfect]
+
+        node_data = {
+            'status':STATUS_PERFECT,
+            'archtree':archtree,
+            'arch_tree_size':archtree.tree_size,
+            'min_wrong':0,
+            'count_below':node.nodes_below_count,
+        }
+
+        return node_data
+
+    # errors of every archive tree, from the gathered output matrix
+    all_count_wrongs = tree_archive.get_all_count_wrongs(
+        node.optimals, node.optimals_mask)
+
     # loop over all other subtrees
     for i_arch_tree, archtree in enumerate(tree_archive.archive):
 
         if i_arch_tree in avoid_i_arch:
             continue
 
-        if problem_data.is_boolean:
-            test_count_wrong = count_wrong_boolean(
-                node.optimals, node.optimals_mask, archtree.tree.outputs)
-
-        elif problem_data.is_integer:
-            test_count_wrong = count_wrong_integer(
-                node.optimals, archtree.tree.outputs)
+        test_count_wrong = all_count_wrongs[i_arch_tree]
 
         # check for perfect answer
         if test_count_wrong == 0:
@@ -253,8 +277,18 @@ def get_node_options(i_node, master_tree, tree_archive, problem_data):
 
         return node_data
 
-def get_node_options_smallest(i_node, master_tree, tree_archive, problem_data):
-    """Returns the possible options for replacing the node."""
+def get_node_options_smallest(i_node, master_tree, tree_archive, problem_data,
+    early_abandon=False, nearest_index=False):
+    """Returns the possible options for replacing the node.
+
+    Arguments:
+    early_abandon -- if True, errors are counted a block of fitness cases
+    at a time and archive trees are dropped as soon as their errors pass
+    the fewest better (or else worst) errors found so far. Archive trees
+    are skipped outright when their per-block lower bounds already do.
+    nearest_index -- if True, better and worst archive trees are found 
+    through the archive nearest index instead of a scan over the archive.
+    """
 
     # find node in master_tree
     node = master_tree[i_node]
@@ -272,19 +306,79 @@ def get_node_options_smallest(i_node, master_tree, tree_archive, problem_data):
     #avoid_i_arch = master_tree.inode_banned_arch[i_node]
     avoid_i_arch = master_tree.ban_rules.get_avoid_indexes(i_node)
 
+    # check for perfect answer through the archive exact match index
+    i_perfect = tree_archive.find_perfect(
+        node.optimals, node.optimals_mask, avoid_i_arch)
+
+    if i_perfect is not None:
+        archtree = tree_archive.archive[i_perfect]
+
+        node_data = {
+            'i_node':i_node,
+            'status':STATUS_PERFECT,
+            'archtrees':[archtree],
+            'archtree_sizes':[archtree.tree_size],
+            'min_wrong':0,
+            'count_below':node.nodes_below_count,
+        }
+
+        return node_data
+
+    scan_archive = tree_archive.archive
+
+    if nearest_index:
+        status, i_archtrees, min_wrong = classify_nearest(tree_archive,
+            node.optimals, node.optimals_mask, node.wrong_count, avoid_i_arch)
+
+        nearest_arch_trees = [tree_archive.archive[i_arch] 
+            for i_arch in i_archtrees]
+
+        if status == STATUS_BETTER:
+            min_better_wrong = min_wrong
+            better_arch_trees = nearest_arch_trees
+
+        elif status == STATUS_WORST:
+            min_worst_wrong = min_wrong
+            worst_arch_trees = nearest_arch_trees
+
+        # the nearest index replaces the scan over the archive
+        scan_archive = []
+
+    if early_abandon:
+        blocked_counter = tree_archive.get_blocked_counter(
+            node.optimals, node.optimals_mask)
+
+    elif scan_archive:
+        # errors of every archive tree, from the gathered output matrix
+        all_count_wrongs = tree_archive.get_all_count_wrongs(
+            node.optimals, node.optimals_mask)
+
     # loop over all other subtrees
-    for i_arch_tree, archtree in enumerate(tree_archive.archive):
+    for i_arch_tree, archtree in enumerate(scan_archive):
+
+        if early_abandon and i_arch_tree % EARLY_ABANDON_CHUNK == 0:
+            # archive trees with more errors than this cannot be options,
+            # the bound only gets tighter within the chunk
+            if min_better_wrong != None:
+                bound = min_better_wrong
+            else:
+                bound = min_worst_wrong
+
+            chunk_count_wrongs = blocked_counter.count_wrongs(
+                i_arch_tree, i_arch_tree + EARLY_ABANDON_CHUNK, bound)
 
         if i_arch_tree in avoid_i_arch:
             continue
 
-        if problem_data.is_boolean:
-            test_count_wrong = count_wrong_boolean(
-                node.optimals, node.optimals_mask, archtree.tree.outputs)
+        if early_abandon:
+            test_count_wrong = chunk_count_wrongs[
+                i_arch_tree % EARLY_ABANDON_CHUNK]
 
-        elif problem_data.is_integer:
-            test_count_wrong = count_wrong_integer(
-                node.optimals, archtree.tree.outputs)
+            if test_count_wrong == None:
+                continue
+
+        else:
+            test_count_wrong = all_count_wrongs[i_arch_tree]
 
         # check for perfect answer
         if test_count_wrong == 0:
@@ -373,4 +467,277 @@ def get_node_options_smallest(i_node, master_tree, tree_archive, problem_data):
             'count_below':node.nodes_below_count,
         }
 
-        return node_data
\ No newline at end of file
+        return node_data
+
+def classify_count_wrongs(count_wrongs, wrong_count, avoid_i_arch):
+    """Given the error counts of all archive trees for one node, returns
+    (status, i_archtrees, min_wrong) following the same rules as
+    get_node_options_smallest: the first perfect archive tree, else all
+    better archive trees with the fewest errors, else all worst archive
+    trees with the fewest errors.
+
+    Arguments:
+    count_wrongs -- numpy array of error counts, one per archive tree
+    wrong_count -- number of errors of the node being replaced
+    avoid_i_arch -- archive indexes which must be ignored.
+    """
+
+    count_wrongs = count_wrongs.copy()
+
+    # banned archive trees are given a negative count and ignored
+    avoid_i_arch = [i_arch for i_arch in avoid_i_arch if i_arch is not None]
+    count_wrongs[avoid_i_arch] = -1
+    allowed = count_wrongs >= 0
+
+    # check for perfect answer
+    i_perfects = np.flatnonzero(allowed & (count_wrongs == 0))
+    if len(i_perfects) > 0:
+        return STATUS_PERFECT, [i_perfects[0]], 0
+
+    # check for better but not perfect, then for worst
+    for status, candidates in [
+        (STATUS_BETTER, allowed & (count_wrongs < wrong_count)),
+        (STATUS_WORST, allowed & (count_wrongs > wrong_count))]:
+
+        if not candidates.any():
+            continue
+
+        min_wrong = count_wrongs[candidates].min()
+        i_archtrees = np.flatnonzero(candidates & (count_wrongs == min_wrong))
+
+        return status, list(i_archtrees), int(min_wrong)
+
+    return STATUS_NONE, [], None
+
+def summarize_blocked(blocked_counter, wrong_count, avoid_i_arch,
+    start, stop):
+    """Summarizes the archive trees from start up to stop for one node as
+    (i_perfect, better, worst), like parallel.summarize_count_wrongs, with
+    the errors counted through a BlockedErrorCounter.
+
+    Chunks of EARLY_ABANDON_CHUNK archive trees are counted in archive
+    order, each under the fewest better (or else worst) errors found so
+    far, so archive trees which cannot be options are dropped early. The
+    worst part is only complete when there is no better part.
+
+    Arguments:
+    blocked_counter -- BlockedErrorCounter of the node optimals
+    wrong_count -- number of errors of the node being replaced
+    avoid_i_arch -- archive indexes which must be ignored
+    start, stop -- archive indexes of the first and after last tree.
+    """
+
+    avoid_i_arch = [i_arch for i_arch in avoid_i_arch if i_arch is not None]
+
+    # (min_wrong, archive indexes) of the better and worst trees so far
+    better = None
+    worst = None
+
+    for chunk_start in range(start, stop, EARLY_ABANDON_CHUNK):
+        chunk_stop = min(chunk_start + EARLY_ABANDON_CHUNK, stop)
+
+        # archive trees with more errors than this cannot be options
+        bound = None
+        if better != None:
+            bound = better[0]
+        elif worst != None:
+            bound = worst[0]
+
+        i_archs, count_wrongs = blocked_counter.count_alive(
+            chunk_start, chunk_stop, bound)
+
+        allowed = ~np.isin(i_archs, avoid_i_arch)
+        i_archs = i_archs[allowed]
+        count_wrongs = count_wrongs[allowed]
+
+        # check for perfect answer
+        i_perfects = i_archs[count_wrongs == 0]
+        if len(i_perfects) > 0:
+            return int(i_perfects[0]), None, None
+
+        # merge the better, then worst, trees of the chunk
+        summaries = []
+        for summary, candidates in [
+            (better, count_wrongs < wrong_count),
+            (worst, count_wrongs > wrong_count)]:
+
+            if candidates.any():
+                min_wrong = int(count_wrongs[candidates].min())
+                i_archtrees = i_archs[
+                    candidates & (count_wrongs == min_wrong)].tolist()
+
+                if summary == None or min_wrong < summary[0]:
+                    summary = (min_wrong, i_archtrees)
+
+                elif min_wrong == summary[0]:
+                    summary = (min_wrong, summary[1] + i_archtrees)
+
+            summaries.append(summary)
+
+        better, worst = summaries
+
+    return None, better, worst
+
+def classify_blocked(blocked_counter, wrong_count, avoid_i_arch):
+    """Returns the classify_count_wrongs result of one node over the whole
+    archive, with the errors counted through a BlockedErrorCounter and
+    archive trees dropped early (see summarize_blocked).
+    """
+
+    i_perfect, better, worst = summarize_blocked(blocked_counter,
+        wrong_count, avoid_i_arch, 0, len(blocked_counter.remaining_bounds))
+
+    if i_perfect is not None:
+        return STATUS_PERFECT, [i_perfect], 0
+
+    for status, summary in [(STATUS_BETTER, better), (STATUS_WORST, worst)]:
+        if summary != None:
+            min_wrong, i_archtrees = summary
+            return status, i_archtrees, min_wrong
+
+    return STATUS_NONE, [], None
+
+def classify_nearest(tree_archive, mn_optimals, mn_optimals_mask, wrong_count,
+    avoid_i_arch):
+    """Returns the classify_count_wrongs result of one node, with the better
+    or worst archive trees found through the archive nearest index instead
+    of a scan over the archive. The archive is assumed to have no perfect
+    archive tree for the node (see TreeArchive.find_perfect).
+    """
+
+    # fewest errors, ignoring archive trees tied with the node itself
+    nearest = tree_archive.find_nearest(
+        mn_optimals, mn_optimals_mask, avoid_i_arch, min_wrong=1)
+
+    if nearest and nearest[0][0] == wrong_count:
+        nearest = tree_archive.find_nearest(mn_optimals, mn_optimals_mask,
+            avoid_i_arch, min_wrong=wrong_count+1)
+
+    if not nearest:
+        return STATUS_NONE, [], None
+
+    min_wrong = nearest[0][0]
+    i_archtrees = [i_arch for _, i_arch in nearest]
+
+    if min_wrong < wrong_count:
+        return STATUS_BETTER, i_archtrees, min_wrong
+
+    return STATUS_WORST, i_archtrees, min_wrong
+
+def get_nodes_options_smallest(i_nodes, master_tree, tree_archive, problem_data,
+    options_pool=None, early_abandon=False, nearest_index=False):
+    """Returns the possible options for replacing each node in i_nodes.
+    The results are the same as calling get_node_options_smallest for each 
+    node. Perfect archive trees are looked up through the archive exact
+    match index, the error counts of the remaining nodes are computed in a
+    single (nodes x archive) matrix pass.
+
+    Requires tree_archive.gather_tree_outputs to have been called.
+
+    Arguments:
+    options_pool -- a parallel.NodeOptionsPool made from tree_archive, if
+    given the remaining nodes are shared out across its worker processes
+    early_abandon -- if True, archive trees are dropped as soon as their
+    errors pass the fewest better (or else worst) errors found so far (see
+    summarize_blocked), not with options_pool. The per-block lower bounds
+    rule out few archive trees, so on the archives tried so far this is 
+    slower than the single matrix pass
+    nearest_index -- if True, better and worst archive trees are found
+    through the archive nearest index (see classify_nearest), in this
+    process, instead of a scan over the archive. Each query still bounds
+    and sorts every archive tree, so this is slower than the single matrix
+    pass.
+    """
+
+    if early_abandon and options_pool is not None:
+        raise ValueError('early_abandon cannot be used with an options_pool')
+
+    # i_node : node_data
+    nodes_data = {}
+
+    # check for perfect answers through the archive exact match index
+    search_i_nodes = []
+    for i_node in i_nodes:
+        node = master_tree[i_node]
+        avoid_i_arch = master_tree.ban_rules.get_avoid_indexes(i_node)
+
+        i_perfect = tree_archive.find_perfect(
+            node.optimals, node.optimals_mask, avoid_i_arch)
+
+        if i_perfect is None:
+            search_i_nodes.append(i_node)
+            continue
+
+        archtree = tree_archive.archive[i_perfect]
+
+        nodes_data[i_node] = {
+            'i_node':i_node,
+            'status':STATUS_PERFECT,
+            'archtrees':[archtree],
+            'archtree_sizes':[archtree.tree_size],
+            'min_wrong':0,
+            'count_below':node.nodes_below_count,
+        }
+
+    nodes = [master_tree[i_node] for i_node in search_i_nodes]
+    avoids = [master_tree.ban_rules.get_avoid_indexes(i_node) 
+        for i_node in search_i_nodes]
+
+    if nearest_index:
+        classified = [classify_nearest(tree_archive, node.optimals,
+            node.optimals_mask, node.wrong_count, avoid_i_arch)
+            for node, avoid_i_arch in zip(nodes, avoids)]
+
+    elif options_pool is not None:
+        classified = options_pool.classify_nodes(
+            [node.optimals for node in nodes],
+            [node.optimals_mask for node in nodes],
+            [node.wrong_count for node in nodes], avoids)
+
+    elif early_abandon:
+        classified = [classify_blocked(
+            tree_archive.get_blocked_counter(node.optimals, node.optimals_mask),
+            node.wrong_count, avoid_i_arch)
+            for node, avoid_i_arch in zip(nodes, avoids)]
+
+    else:
+        if problem_data.is_boolean:
+            wrong_matrix = tree_archive.get_count_wrongs_matrix(
+                [node.optimals for node in nodes],
+                [node.optimals_mask for node in nodes])
+
+        elif problem_data.is_integer:
+            wrong_matrix = tree_archive.get_count_wrongs_matrix(
+                [node.optimals for node in nodes])
+
+        classified = [classify_count_wrongs(
+            count_wrongs, node.wrong_count, avoid_i_arch) 
+            for node, count_wrongs, avoid_i_arch 
+            in zip(nodes, wrong_matrix, avoids)]
+
+    for i_node, node, (status, i_archtrees, min_wrong) in zip(
+        search_i_nodes, nodes, classified):
+
+        if status == STATUS_NONE:
+            nodes_data[i_node] = {
+                'i_node':i_node,
+                'status':STATUS_NONE,
+                'count_below':node.nodes_below_count,
+            }
+            continue
+
+        archtrees = [tree_archive.archive[i_arch] for i_arch in i_archtrees]
+
+        nodes_data[i_node] = {
+            'i_node':i_node,
+            'status':status,
+            'archtrees':archtrees,
+
+            'archtree_sizes':[archtree.tree_size 
+                for archtree in archtrees],
+
+            'min_wrong':min_wrong,
+            'count_below':node.nodes_below_count,
+        }
+
+    return [nodes_data[i_node] for i_node in i_nodes]
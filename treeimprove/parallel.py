@@ -0,0 +1,336 @@
+import os
+import concurrent.futures
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .improve import classify_count_wrongs
+from .improve import STATUS_PERFECT, STATUS_BETTER, STATUS_WORST, STATUS_NONE
+from .problem_data import problem_data_boolean
+from .problem_data import problem_data_integer
+
+# state of each worker process of a NodeOptionsPool
+WORKER_STATE = {}
+
+def init_options_worker(shm_name, shape, dtype, boolean_flag):
+    """Pool initializer of NodeOptionsPool, attaches the archive output
+    matrix held in shared memory.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    WORKER_STATE['shm'] = shm
+    WORKER_STATE['boolean_flag'] = boolean_flag
+    WORKER_STATE['trees_outputs'] = np.ndarray(
+        shape, dtype=dtype, buffer=shm.buf)
+
+def run_worker_task(task, *args):
+    """Runs task(trees_outputs, boolean_flag, *args) in a worker process,
+    on the archive output matrix attached by init_options_worker.
+    """
+    return task(WORKER_STATE['trees_outputs'], WORKER_STATE['boolean_flag'],
+        *args)
+
+def classify_nodes_task(trees_outputs, boolean_flag, optimals_rows,
+    masks_rows, wrong_counts, avoids):
+    """Worker task of NodeOptionsPool. Counts the errors of every archive
+    tree against each row of optimals_rows (and masks_rows in the Boolean
+    case) and returns the classify_count_wrongs result of each node.
+    """
+    wrong_matrix = count_wrongs_rows(
+        trees_outputs, boolean_flag, optimals_rows, masks_rows)
+
+    return [classify_count_wrongs(count_wrongs, wrong_count, avoid_i_arch)
+        for count_wrongs, wrong_count, avoid_i_arch
+        in zip(wrong_matrix, wrong_counts, avoids)]
+
+def count_wrongs_rows(trees_outputs, boolean_flag, optimals_rows, masks_rows):
+    """Returns the (nodes x trees) error counts of the rows of
+    trees_outputs against the node optimals (and masks, Boolean case).
+    """
+    if boolean_flag:
+        return problem_data_boolean.count_wrongs_matrix(
+            trees_outputs, optimals_rows, masks_rows)
+
+    return problem_data_integer.count_wrongs_matrix(
+        trees_outputs, optimals_rows)
+
+def summarize_count_wrongs(count_wrongs, wrong_count, avoid_i_arch, start):
+    """Summarizes the error counts of one archive shard for one node as
+    (i_perfect, better, worst), where i_perfect is the first perfect
+    archive index (or None) and better and worst are (min_wrong, archive
+    indexes) pairs (or None). Archive indexes are offset by start, the
+    index of the first tree of the shard.
+    """
+    count_wrongs = count_wrongs.copy()
+
+    # banned archive trees are given a negative count and ignored
+    count_wrongs[[i_arch - start for i_arch in avoid_i_arch
+        if start <= i_arch < start + len(count_wrongs)]] = -1
+    allowed = count_wrongs >= 0
+
+    i_perfects = np.flatnonzero(allowed & (count_wrongs == 0))
+    i_perfect = None
+    if len(i_perfects) > 0:
+        i_perfect = int(i_perfects[0]) + start
+
+    summaries = []
+    for candidates in [
+        allowed & (count_wrongs < wrong_count),
+        allowed & (count_wrongs > wrong_count)]:
+
+        if not candidates.any():
+            summaries.append(None)
+            continue
+
+        min_wrong = int(count_wrongs[candidates].min())
+        i_archtrees = np.flatnonzero(candidates & (count_wrongs == min_wrong))
+        summaries.append((min_wrong, (i_archtrees + start).tolist()))
+
+    return i_perfect, summaries[0], summaries[1]
+
+def reduce_summaries(summaries):
+    """Merges the summarize_count_wrongs results of the archive shards
+    of one node, given in archive order, into the (status, i_archtrees,
+    min_wrong) which classify_count_wrongs gives for the whole archive.
+    """
+    i_perfects = [i_perfect for i_perfect, _, _ in summaries
+        if i_perfect is not None]
+
+    if i_perfects:
+        return STATUS_PERFECT, [i_perfects[0]], 0
+
+    for status, i_part in [(STATUS_BETTER, 1), (STATUS_WORST, 2)]:
+        parts = [summary[i_part] for summary in summaries
+            if summary[i_part] is not None]
+
+        if not parts:
+            continue
+
+        # ties between shards keep archive order
+        min_wrong = min(part_min_wrong for part_min_wrong, _ in parts)
+        i_archtrees = [i_arch for part_min_wrong, part_i_archs in parts
+            if part_min_wrong == min_wrong for i_arch in part_i_archs]
+
+        return status, i_archtrees, min_wrong
+
+    return STATUS_NONE, [], None
+
+def summarize_shard_task(trees_outputs, boolean_flag, start, stop,
+    optimals_rows, masks_rows, wrong_counts, avoids):
+    """Worker task of ArchiveShardPool. Returns the summarize_count_wrongs
+    result of each node for the archive trees from start up to stop.
+    """
+    wrong_matrix = count_wrongs_rows(
+        trees_outputs[start:stop], boolean_flag, optimals_rows, masks_rows)
+
+    return [summarize_count_wrongs(count_wrongs, wrong_count, avoid_i_arch, start)
+        for count_wrongs, wrong_count, avoid_i_arch
+        in zip(wrong_matrix, wrong_counts, avoids)]
+
+def get_shard_bounds(num_trees, num_shards):
+    """Returns the (start, stop) archive indexes of num_shards contiguous
+    shards of about equal size, leaving out empty shards.
+    """
+    bounds = np.linspace(0, num_trees, num_shards + 1).astype(int)
+
+    return [(int(start), int(stop))
+        for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+class NodeOptionsPool(object):
+    """A pool of worker processes which classify the archive trees for
+    several master tree nodes at once (see get_nodes_options_smallest).
+
+    The archive output matrix is copied into shared memory once, when
+    the pool is made. Each task only carries the optimals, masks, error
+    counts and banned archive indexes of a batch of nodes, and only the
+    (status, i_archtrees, min_wrong) of each node is sent back.
+
+    If num_shards is given, the archive rather than the nodes is split
+    between the tasks (see ArchiveShardPool).
+
+    The pool must be closed (or used as a context manager) to release
+    the worker processes and the shared memory.
+    """
+
+    def __init__(self, tree_archive, num_workers=None, num_shards=None):
+        self.boolean_flag = tree_archive.boolean_flag
+
+        if num_workers == None:
+            num_workers = os.cpu_count()
+        self.num_workers = num_workers
+
+        # (start, stop) archive indexes of each shard, None splits the nodes
+        self.shard_bounds = None
+        if num_shards != None:
+            self.shard_bounds = get_shard_bounds(
+                len(tree_archive.trees_outputs), num_shards)
+
+        self.start_workers(tree_archive)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start_workers(self, tree_archive):
+        """Copies the archive output matrix into shared memory and starts
+        the worker processes.
+        """
+        trees_outputs = np.ascontiguousarray(tree_archive.trees_outputs)
+
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(1, trees_outputs.nbytes))
+        shared_outputs = np.ndarray(trees_outputs.shape,
+            dtype=trees_outputs.dtype, buffer=self.shm.buf)
+        shared_outputs[...] = trees_outputs
+
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            self.num_workers, initializer=init_options_worker,
+            initargs=(self.shm.name, trees_outputs.shape,
+                trees_outputs.dtype.str, self.boolean_flag))
+
+    def submit(self, task, *args):
+        """Schedules task(trees_outputs, boolean_flag, *args) on a worker
+        and returns its future.
+        """
+        return self.executor.submit(run_worker_task, task, *args)
+
+    def close(self):
+        """Stops the worker processes and frees the shared memory."""
+        if self.executor is None:
+            return
+
+        self.executor.shutdown()
+        self.executor = None
+
+        self.shm.close()
+        self.shm.unlink()
+
+    def pack_nodes(self, nodes_optimals, nodes_masks, avoids):
+        """Returns the node optimals and masks as packed rows, and the
+        banned archive indexes without None entries.
+        """
+        if self.boolean_flag:
+            optimals_rows = problem_data_boolean.pack_rows(nodes_optimals)
+            masks_rows = problem_data_boolean.pack_rows(nodes_masks)
+        else:
+            optimals_rows = np.array(nodes_optimals)
+            masks_rows = None
+
+        avoids = [[i_arch for i_arch in avoid_i_arch if i_arch is not None]
+            for avoid_i_arch in avoids]
+
+        return optimals_rows, masks_rows, avoids
+
+    def classify_nodes(self, nodes_optimals, nodes_masks, wrong_counts, avoids):
+        """Returns the classify_count_wrongs result of each node, splitting
+        the nodes into one batch per worker, or when sharded, scoring all
+        nodes against each archive shard.
+
+        Arguments:
+        nodes_optimals -- list of optimal arrays, one per node
+        nodes_masks -- list of the matching optimal masks (Boolean case only)
+        wrong_counts -- number of errors of each node
+        avoids -- archive indexes each node must ignore.
+        """
+        num_nodes = len(nodes_optimals)
+        if num_nodes == 0:
+            return []
+
+        if self.shard_bounds != None:
+            return self.classify_nodes_sharded(
+                nodes_optimals, nodes_masks, wrong_counts, avoids)
+
+        optimals_rows, masks_rows, avoids = self.pack_nodes(
+            nodes_optimals, nodes_masks, avoids)
+
+        batch_size = -(-num_nodes // self.num_workers)
+
+        futures = []
+        for start in range(0, num_nodes, batch_size):
+            stop = start + batch_size
+
+            futures.append(self.submit(classify_nodes_task,
+                optimals_rows[start:stop],
+                None if masks_rows is None else masks_rows[start:stop],
+                wrong_counts[start:stop], avoids[start:stop]))
+
+        results = []
+        for future in futures:
+            results += future.result()
+
+        return results
+
+    def classify_nodes_sharded(self, nodes_optimals, nodes_masks,
+        wrong_counts, avoids):
+        """Returns the classify_count_wrongs result of each node, scoring
+        all nodes against each archive shard in parallel.
+        """
+        if not self.shard_bounds:
+            return [(STATUS_NONE, [], None)] * len(nodes_optimals)
+
+        optimals_rows, masks_rows, avoids = self.pack_nodes(
+            nodes_optimals, nodes_masks, avoids)
+
+        futures = [self.submit(summarize_shard_task, start, stop,
+            optimals_rows, masks_rows, wrong_counts, avoids)
+            for start, stop in self.shard_bounds]
+
+        shards_summaries = [future.result() for future in futures]
+
+        return [reduce_summaries(node_summaries)
+            for node_summaries in zip(*shards_summaries)]
+
+class ArchiveShardPool(NodeOptionsPool):
+    """A NodeOptionsPool which splits the archive, rather than the nodes,
+    into num_shards contiguous shards of archive trees (one per worker by
+    default). Each task scores every node against one shard and returns
+    a small summary per node (see summarize_count_wrongs), the summaries
+    are then reduced in archive order with the tie breaking of
+    classify_count_wrongs.
+
+    This suits large archives queried by few nodes, where splitting the
+    nodes leaves each worker a full archive scan.
+    """
+
+    def __init__(self, tree_archive, num_workers=None, num_shards=None):
+        if num_workers == None:
+            num_workers = os.cpu_count()
+
+        if num_shards == None:
+            num_shards = num_workers
+
+        super().__init__(tree_archive, num_workers, num_shards)
+
+class ThreadOptionsPool(NodeOptionsPool):
+    """A NodeOptionsPool made of threads of the calling process. The
+    threads read the archive output matrix in place, so nothing is copied
+    or pickled, and there are no processes to start. The error counting
+    kernels are large numpy calls over the packed matrix, which release
+    the GIL, so the threads run on separate cores.
+
+    Nodes are split between the threads, or the archive if num_shards is
+    given.
+    """
+
+    def start_workers(self, tree_archive):
+        """Starts the worker threads."""
+        self.trees_outputs = tree_archive.trees_outputs
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.num_workers)
+
+    def submit(self, task, *args):
+        """Schedules task(trees_outputs, boolean_flag, *args) on a thread
+        and returns its future.
+        """
+        return self.executor.submit(
+            task, self.trees_outputs, self.boolean_flag, *args)
+
+    def close(self):
+        """Stops the worker threads."""
+        if self.executor is None:
+            return
+
+        self.executor.shutdown()
+        self.executor = None
@@ -1,119 +1,132 @@
 import itertools
+import numpy as np
 from bitarray import bitarray
+from bitarray.util import count_and
 
 from . import benchmarks_boolean
 
 def op_and(b_vals, c_vals):
-    """Logical AND operator."""
-    a_vals = [False]*len(b_vals)
-    for i, (b_val, c_val) in enumerate(zip(b_vals, c_vals)):
-        if b_val and c_val:
-            a_vals[i] = True
-    return bitarray(a_vals)
+    """Logical AND operator. Works on whole packed words."""
+    return b_vals & c_vals
 
 def op_or(b_vals, c_vals):
-    """Logical OR operator."""
-    a_vals = [False]*len(b_vals)
-    for i, (b_val, c_val) in enumerate(zip(b_vals, c_vals)):
-        if b_val or c_val:
-            a_vals[i] = True
-    return bitarray(a_vals)
+    """Logical OR operator. Works on whole packed words."""
+    return b_vals | c_vals
 
 def op_nand(b_vals, c_vals):
-    """Logical NAND operator."""
-    a_vals = [False]*len(b_vals)
-    for i, (b_val, c_val) in enumerate(zip(b_vals, c_vals)):
-        if not (b_val and c_val):
-            a_vals[i] = True
-    return bitarray(a_vals)
+    """Logical NAND operator. Works on whole packed words."""
+    return ~(b_vals & c_vals)
 
 def op_nor(b_vals, c_vals):
-    """Logical NOR operator."""
-    a_vals = [False]*len(b_vals)
-    for i, (b_val, c_val) in enumerate(zip(b_vals, c_vals)):
-        if not (b_val or c_val):
-            a_vals[i] = True
-    return bitarray(a_vals)
-
-def rev_and(A, b):
-
-    if A == False and b == False:
-        return 2
-    if A == False and b == True:
-        return False
-    if A == True and b == True:
-        return True
-    if A == 2 and b == True:
-        return 2
-    if A == 2 and b == False:
-        return 2
-    
-    if A == True and b == False:
-        return True
-
-    print(A, b)
-    print('rev_and error')
-    exit()
-
-def rev_or(A, b):
-
-    if A == False and b == False:
-        return False
-    if A == True and b == True:
-        return 2
-    if A == True and b == False:
-        return True
-    if A == 2 and b == True:
-        return 2
-    if A == 2 and b == False:
-        return 2
-
-    if A == False and b == True:
-        return False
-
-    print(A, b)
-    print('rev_or error')
-    exit()
-
-def rev_nand(A, b):
-
-    if A == True and b == False:
-        return 2
-    if A == True and b == True:
-        return False
-    if A == False and b == True:
-        return True
-    if A == 2 and b == True:
-        return 2
-    if A == 2 and b == False:
-        return 2
-
-    if A == False and b == False:
-        return True
-
-    print(A, b)
-    print('rev_nand error')
-    exit()
-
-def rev_nor(A, b):
-
-    if A == True and b == False:
-        return False
-    if A == False and b == True:
-        return 2
-    if A == False and b == False:
-        return True
-    if A == 2 and b == True:
-        return 2
-    if A == 2 and b == False:
-        return 2
-
-    if A == True and b == True:
-        return False
-
-    print(A, b)
-    print('rev_nor error')
-    exit()
+    """Logical NOR operator. Works on whole packed words."""
+    return ~(b_vals | c_vals)
+
+def rev_and(A_optimals, A_mask, b_outputs):
+    """Inverse of the logical AND operator. Given the parent optimals
+    (A_optimals, A_mask) and the sibling outputs (b_outputs), returns
+    the (optimals, optimals_mask) pair of the other child.
+
+    A masked (hash) optimal is returned wherever the parent is masked
+    or the child value does not matter (A False and b False).
+    """
+    mask = A_mask | ~(A_optimals | b_outputs)
+    return A_optimals & ~mask, mask
+
+def rev_or(A_optimals, A_mask, b_outputs):
+    """Inverse of the logical OR operator. The child value does not
+    matter where A is True and b is True.
+    """
+    mask = A_mask | (A_optimals & b_outputs)
+    return A_optimals & ~mask, mask
+
+def rev_nand(A_optimals, A_mask, b_outputs):
+    """Inverse of the logical NAND operator. The child value does not
+    matter where A is True and b is False.
+    """
+    mask = A_mask | (A_optimals & ~b_outputs)
+    return ~(A_optimals | mask), mask
+
+def rev_nor(A_optimals, A_mask, b_outputs):
+    """Inverse of the logical NOR operator. The child value does not
+    matter where A is False and b is True.
+    """
+    mask = A_mask | (b_outputs & ~A_optimals)
+    return ~(A_optimals | mask), mask
+
+def count_wrongs(outputs, optimals, optimals_mask):
+    """Counts the number of errors of an output array given an optimals
+    array and its mask: popcount((outputs ^ optimals) & ~optimals_mask).
+    """
+    return count_and(outputs ^ optimals, ~optimals_mask)
+
+def count_twos(optimals_mask):
+    """Counts the number of hashes (masked optimals) in a mask array."""
+    return optimals_mask.count()
+
+# number of set bits in each possible byte value
+POPCOUNT_TABLE = np.array(
+    [bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+def popcount_rows(matrix):
+    """Counts the set bits along the last axis of a packed uint8 matrix.
+    Uses the numpy bitwise_count ufunc when available (numpy >= 2.0), on
+    64 bit words where the rows allow it. Like other large ufunc calls it
+    releases the GIL, so several threads can count at once.
+    """
+    if not hasattr(np, 'bitwise_count'):
+        return POPCOUNT_TABLE[matrix].sum(axis=-1, dtype=np.int64)
+
+    if matrix.shape[-1] % 8 == 0 and matrix.flags.c_contiguous:
+        matrix = matrix.view(np.uint64)
+
+    return np.bitwise_count(matrix).sum(axis=-1, dtype=np.int64)
+
+def pack_rows(bit_arrays):
+    """Packs equal length bitarrays into a contiguous (rows x bytes)
+    uint8 matrix. Padding bits at the end of each row are zero.
+    """
+    if len(bit_arrays) == 0:
+        return np.zeros((0, 0), dtype=np.uint8)
+
+    packed = b''.join(bit_array.tobytes() for bit_array in bit_arrays)
+    return np.frombuffer(packed, dtype=np.uint8).reshape(len(bit_arrays), -1)
+
+def count_wrongs_matrix(outputs_matrix, optimals_matrix, masks_matrix,
+    max_chunk_bytes=2**24):
+    """Counts the errors of every row of outputs_matrix against every row
+    of optimals_matrix (masked by masks_matrix). All matrices are packed
+    by pack_rows. Returns an (optimals rows x outputs rows) matrix.
+
+    Work is split into chunks so that temporary arrays stay below
+    max_chunk_bytes.
+    """
+    num_rows = len(optimals_matrix)
+    num_cols = len(outputs_matrix)
+    wrong_counts = np.zeros((num_rows, num_cols), dtype=np.int64)
+
+    if num_rows == 0 or num_cols == 0:
+        return wrong_counts
+
+    care_matrix = ~masks_matrix
+    row_bytes = outputs_matrix.shape[1]
+
+    # chunk over outputs rows then over optimals rows
+    cols_step = max(1, min(num_cols, max_chunk_bytes // row_bytes))
+    rows_step = max(1, max_chunk_bytes // (cols_step * row_bytes))
+
+    for col_start in range(0, num_cols, cols_step):
+        outputs_chunk = outputs_matrix[None, col_start:col_start+cols_step]
+
+        for row_start in range(0, num_rows, rows_step):
+            row_stop = row_start + rows_step
+
+            diffs = outputs_chunk ^ optimals_matrix[row_start:row_stop, None]
+            diffs &= care_matrix[row_start:row_stop, None]
+
+            wrong_counts[row_start:row_stop, col_start:col_start+cols_step] = \
+                popcount_rows(diffs)
+
+    return wrong_counts
 
 class ProblemDataBoolean(object):
     """This class stores all relavant Boolean benchmark methods
@@ -128,6 +141,9 @@ class ProblemDataBoolean(object):
         self.is_integer = False
 
         self.operators = [op_and, op_or, op_nand, op_nor]
+
+        # operators with op(b, c) == op(c, b)
+        self.commutative_operators = set(self.operators)
         self.ephemerals = []
 
         # primitive name : opposite primitive
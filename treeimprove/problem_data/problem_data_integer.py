@@ -2,95 +2,99 @@ import operator
 import itertools
 from collections import defaultdict
 
+import numpy as np
+
 from . import benchmarks_integer as benchmarks
+from .problem_data_boolean import POPCOUNT_TABLE
+
+# Cayley tables of the finite algebra operators, a = TABLE[b][c].
+# Operators are applied to all fitness cases at once by fancy indexing.
+
+A1_TABLE = np.array([
+    [2, 1, 2],
+    [1, 0, 0],
+    [0, 0, 1]
+], dtype=np.uint8)
 
 def a1(b_vals, c_vals):
-    op_def = [
-        [2, 1, 2],
-        [1, 0, 0],
-        [0, 0, 1]
-    ]
-    ret_vals = [0]*len(b_vals)
-    for i in range(len(b_vals)):
-        b = b_vals[i]
-        c = c_vals[i]
-        ret_vals[i] = op_def[b][c]
-    return ret_vals
+    """Finite algebra operator A1."""
+    return A1_TABLE[b_vals, c_vals]
+
+A2_TABLE = np.array([
+    [2, 0, 2],
+    [1, 0, 2],
+    [1, 2, 1]
+], dtype=np.uint8)
 
 def a2(b_vals, c_vals):
-    op_def = [
-        [2, 0, 2],
-        [1, 0, 2],
-        [1, 2, 1]
-    ]
-    ret_vals = [0]*len(b_vals)
-    for i in range(len(b_vals)):
-        b = b_vals[i]
-        c = c_vals[i]
-        ret_vals[i] = op_def[b][c]
-    return ret_vals
+    """Finite algebra operator A2."""
+    return A2_TABLE[b_vals, c_vals]
+
+A3_TABLE = np.array([
+    [1, 0, 1],
+    [1, 2, 0],
+    [0, 0, 0]
+], dtype=np.uint8)
 
 def a3(b_vals, c_vals):
-    op_def = [
-        [1, 0, 1],
-        [1, 2, 0],
-        [0, 0, 0]
-    ]
-    ret_vals = [0]*len(b_vals)
-    for i in range(len(b_vals)):
-        b = b_vals[i]
-        c = c_vals[i]
-        ret_vals[i] = op_def[b][c]
-    return ret_vals
+    """Finite algebra operator A3."""
+    return A3_TABLE[b_vals, c_vals]
+
+A4_TABLE = np.array([
+    [1, 0, 1],
+    [0, 2, 0],
+    [0, 1, 0]
+], dtype=np.uint8)
 
 def a4(b_vals, c_vals):
-    op_def = [
-        [1, 0, 1],
-        [0, 2, 0],
-        [0, 1, 0]
-    ]
-    ret_vals = [0]*len(b_vals)
-    for i in range(len(b_vals)):
-        b = b_vals[i]
-        c = c_vals[i]
-        ret_vals[i] = op_def[b][c]
-    return ret_vals
+    """Finite algebra operator A4."""
+    return A4_TABLE[b_vals, c_vals]
+
+A5_TABLE = np.array([
+    [1, 0, 2],
+    [1, 2, 0],
+    [0, 1, 0]
+], dtype=np.uint8)
 
 def a5(b_vals, c_vals):
-    op_def = [
-        [1, 0, 2],
-        [1, 2, 0],
-        [0, 1, 0]
-    ]
-    ret_vals = [0]*len(b_vals)
-    for i in range(len(b_vals)):
-        b = b_vals[i]
-        c = c_vals[i]
-        ret_vals[i] = op_def[b][c]
-    return ret_vals
+    """Finite algebra operator A5."""
+    return A5_TABLE[b_vals, c_vals]
+
+B1_TABLE = np.array([
+    [1, 3, 1, 0],
+    [3, 2, 0, 1],
+    [0, 1, 3, 1],
+    [1, 0, 2, 0]
+], dtype=np.uint8)
 
 def b1(b_vals, c_vals):
-    op_def = [
-        [1, 3, 1, 0],
-        [3, 2, 0, 1],
-        [0, 1, 3, 1],
-        [1, 0, 2, 0]
-    ]
-    ret_vals = [0]*len(b_vals)
-    for i in range(len(b_vals)):
-        b = b_vals[i]
-        c = c_vals[i]
-        ret_vals[i] = op_def[b][c]
-    return ret_vals
-
-a_data = defaultdict(dict)
-
-def map_reverse(op, variables):
-    """Produces the reverse mapping for the finite algebra op.
+    """Finite algebra operator B1."""
+    return B1_TABLE[b_vals, c_vals]
+
+def is_commutative(op, variables):
+    """Returns True if op(b, c) == op(c, b) for every pair of values,
+    i.e. if the Cayley table of op equals its transpose.
+    """
+    values = np.array(variables, dtype=np.uint8)
+    table = op(values[:, None], values[None, :])
+
+    return bool(np.array_equal(table, table.T))
+
+# side index of the child node whose optimals are looked up
+SIDE_LEFT = 0
+SIDE_RIGHT = 1
+
+def map_reverse(op, variables, optimals_dtype=np.uint8):
+    """Produces the reverse mapping for the finite algebra op, compiled
+    into a dense lookup table rev_table. rev_table[A, other, side] is the
+    optimal set of a child node given the optimal set A of its parent,
+    the output of its sibling (other) and its side (SIDE_LEFT when finding
+    node b given c, SIDE_RIGHT when finding node c given b).
     
     Arguments:
     variables -- the numbers used by the operators. For three variable
     operators these variables are: 0, 1, and 2.
+    optimals_dtype -- the numpy type used for optimal sets.
     """
 
     # compute inverse of catagorical finite algebra operator
@@ -108,7 +112,7 @@ def map_reverse(op, variables):
 
     for b in variables:
         for c in variables:
-            a = op([b], [c])[0]
+            a = int(op([b], [c])[0])
             all_data.append((a, b, c))
 
     a_data = defaultdict(dict)
@@ -166,29 +170,62 @@ def map_reverse(op, variables):
         for miss_c in missing_c_vals:
             a_data[a_vals]['c'][miss_c] = best_b
 
-    return a_data
+    # compile into table indexed by (parent optimal set, sibling output, side)
+    rev_table = np.zeros((2**len(variables), len(variables), 2), 
+        dtype=optimals_dtype)
+
+    for a_vals in a_data.keys():
+        A = sum(1 << a for a in a_vals)
+
+        for c, b_vals in a_data[a_vals]['c'].items():
+            rev_table[A, c, SIDE_LEFT] = sum(1 << b for b in b_vals)
+
+        for b, c_vals in a_data[a_vals]['b'].items():
+            rev_table[A, b, SIDE_RIGHT] = sum(1 << c for c in c_vals)
+
+    return rev_table
 
-def rev_op(a, other, is_left=False):
-    """If is_left is True, we are finding the optimums of 
-    node b (other=c), otherwise node c (other=b).
+def count_wrongs(outputs, optimal_sets):
+    """Counts the number of errors of an output array given an array of
+    optimal sets. Each optimal set is a bitmask of the acceptable values
+    for a fitness case, an output is wrong when its bit is not set.
     """
+    output_sets = np.left_shift(1, outputs, dtype=optimal_sets.dtype)
+    return int(np.count_nonzero((output_sets & optimal_sets) == 0))
 
-    if type(a) == int:
-        a = (a,)
+def count_twos(optimal_sets):
+    """Counts the number of extra acceptable values (beyond the first)
+    over all optimal sets.
+    """
+    num_values = int(POPCOUNT_TABLE[
+        np.ascontiguousarray(optimal_sets).view(np.uint8)].sum())
+    return num_values - len(optimal_sets)
+
+def count_wrongs_matrix(outputs_matrix, optimals_matrix, max_chunk_bytes=2**24):
+    """Counts the errors of every row of outputs_matrix against every row
+    of optimal sets in optimals_matrix. Returns an 
+    (optimals rows x outputs rows) matrix.
+
+    Work is split into chunks so that temporary arrays stay below
+    max_chunk_bytes.
+    """
+    num_rows = len(optimals_matrix)
+    num_cols = len(outputs_matrix)
+    wrong_counts = np.zeros((num_rows, num_cols), dtype=np.int64)
+
+    if num_rows == 0 or num_cols == 0:
+        return wrong_counts
 
-    # finding values of node b, given c
-    if is_left:
-        ret_val = a_data[a]['c'][other]
-        if len(ret_val) == 1:
-            return ret_val[0]
-        return ret_val
+    output_sets = np.left_shift(1, outputs_matrix, dtype=optimals_matrix.dtype)
+    rows_step = max(1, max_chunk_bytes // output_sets.nbytes)
 
-    # finding values of node c, given b
-    else:
-        ret_val = a_data[a]['b'][other]
-        if len(ret_val) == 1:
-            return ret_val[0]
-        return ret_val
+    for row_start in range(0, num_rows, rows_step):
+        row_stop = row_start + rows_step
+
+        misses = output_sets[None] & optimals_matrix[row_start:row_stop, None]
+        wrong_counts[row_start:row_stop] = np.count_nonzero(misses == 0, axis=2)
+
+    return wrong_counts
 
 class ProblemDataInteger(object):
     """This class stores all relavant finite algebra (integer) benchmark methods
@@ -231,23 +268,32 @@ class ProblemDataInteger(object):
 
         self.operators = [op]
 
-        global a_data
-        a_data = map_reverse(op, self.variables)
+        # operators with op(b, c) == op(c, b)
+        self.commutative_operators = set(op for op in self.operators
+            if is_commutative(op, self.variables))
+
+        # optimal sets are stored as bitmasks of acceptable values
+        if len(self.variables) <= 8:
+            self.optimals_dtype = np.uint8
+        else:
+            self.optimals_dtype = np.uint16
+
+        # each problem instance owns its reverse lookup tables
+        self.op_reverse = {
+            op : map_reverse(op, self.variables, self.optimals_dtype),
+        }
 
         '''
         # for checking the psudo-inverse operator mapping by hand
-        for a_val in a_data.keys():
-            print a_val
-            print 'given b, find c : ', a_data[a_val]['b']
-            print 'given c, find b : ', a_data[a_val]['c']
-            print ''
+        rev_table = self.op_reverse[op]
+        for A in range(1, len(rev_table)):
+            print(A)
+            print('given b, find c : ', rev_table[A, :, SIDE_RIGHT])
+            print('given c, find b : ', rev_table[A, :, SIDE_LEFT])
+            print('')
         exit()
         '''
 
-        self.op_reverse = {
-            op : rev_op,
-        }
-
         self.ephemerals = []
 
         self.input_patterns = self.gen_inputs()
@@ -256,6 +302,7 @@ class ProblemDataInteger(object):
         self.arguments = list(self.arg_vals)
 
         self.target_outputs = self.gen_targets()
+        self.target_optimals = self.values_to_sets(self.target_outputs)
 
     def __deepcopy__(self, memo):
         """When doing deepcopy of a tree we avoid
@@ -323,6 +370,9 @@ class ProblemDataInteger(object):
             for i_arg, arg_val in enumerate(input_point):
                 arg_vals['ARG' + str(i_arg)].append(arg_val)
 
+        for arg_name in list(arg_vals):
+            arg_vals[arg_name] = np.array(arg_vals[arg_name], dtype=np.uint8)
+
         return arg_vals
 
     def gen_targets(self):
@@ -336,9 +386,16 @@ class ProblemDataInteger(object):
 
         target_outputs = [objective_func(input_pattern) 
             for input_pattern in self.input_patterns]
+        target_outputs = np.array(target_outputs, dtype=np.uint8)
 
         return target_outputs
 
+    def values_to_sets(self, values):
+        """Converts an array of values into an array of single value
+        optimal sets.
+        """
+        return np.left_shift(1, values, dtype=self.optimals_dtype)
+
     @property
     def num_fit_tests(self):
         return len(self.input_patterns)
@@ -0,0 +1,419 @@
+from array import array
+from bitarray import bitarray
+
+from .tree import Tree, IndexBanRules
+from .node import NodeBoolean, NodeInteger
+from ..problem_data import problem_data_boolean
+from ..problem_data import problem_data_integer
+
+# array typecode of the node index arrays, 4 byte signed integers
+INDEX_TYPECODE = 'i'
+
+class SymbolTable(object):
+    """Maps the node symbols (arguments, ephemerals and operators) of a
+    problem to small integer codes, shared between flat trees.
+    """
+    __slots__ = ('problem_data', 'symbols', 'codes')
+
+    def __init__(self, problem_data):
+        self.problem_data = problem_data
+
+        # (type, name, operator) of each code
+        self.symbols = []
+        self.codes = {}
+
+        for argument in problem_data.arguments:
+            self.add('arg', argument, None)
+
+        for ephemeral in problem_data.ephemerals:
+            self.add('eph', str(ephemeral), None)
+
+        for operator in problem_data.operators:
+            self.add('op', operator.__name__, operator)
+
+    def add(self, node_type, name, operator):
+        """Adds a symbol, returns its code."""
+        key = (node_type, name)
+
+        if key not in self.codes:
+            self.codes[key] = len(self.symbols)
+            self.symbols.append((node_type, name, operator))
+
+        return self.codes[key]
+
+    def get_code(self, node):
+        """Returns the code of a BaseNode."""
+        return self.add(node.type, node.name, node.operator)
+
+class FlatNode(object):
+    """Light read only view of a single FlatTree node, giving the
+    BaseNode attributes.
+    """
+    __slots__ = ('tree', 'i_node')
+
+    def __init__(self, tree, i_node):
+        self.tree = tree
+        self.i_node = i_node
+
+    def __eq__(self, other):
+        return (isinstance(other, FlatNode) and other.tree is self.tree
+            and other.i_node == self.i_node)
+
+    def __hash__(self):
+        return hash((id(self.tree), self.i_node))
+
+    def __str__(self):
+        return self.tree.subtree_str(self.i_node)
+
+    def get_relative(self, i_node):
+        if i_node < 0:
+            return None
+        return FlatNode(self.tree, i_node)
+
+    @property
+    def type(self):
+        return self.tree.symbols.symbols[self.tree.codes[self.i_node]][0]
+
+    @property
+    def name(self):
+        return self.tree.symbols.symbols[self.tree.codes[self.i_node]][1]
+
+    @property
+    def operator(self):
+        return self.tree.symbols.symbols[self.tree.codes[self.i_node]][2]
+
+    @property
+    def parent(self):
+        return self.get_relative(self.tree.parents[self.i_node])
+
+    @property
+    def left_child(self):
+        return self.get_relative(self.tree.lefts[self.i_node])
+
+    @property
+    def right_child(self):
+        return self.get_relative(self.tree.rights[self.i_node])
+
+    @property
+    def nodes_below_count(self):
+        return self.tree.sizes[self.i_node]
+
+    @property
+    def outputs(self):
+        return self.tree.node_outputs[self.i_node]
+
+    @property
+    def optimals(self):
+        return self.tree.node_optimals[self.i_node]
+
+    @property
+    def optimals_mask(self):
+        return self.tree.node_optimals_masks[self.i_node]
+
+    @property
+    def wrong_count(self):
+        return self.tree.wrong_counts[self.i_node]
+
+    @property
+    def twos_count(self):
+        return self.tree.twos_counts[self.i_node]
+
+class FlatTree(object):
+    """Compact alternative to Tree. Nodes are held in prefix order (root,
+    left subtree, right subtree) as parallel arrays of symbol codes, child
+    and parent indexes (-1 for none) and subtree sizes. A subtree is
+    therefore the contiguous slice [i_node, i_node + sizes[i_node]).
+
+    Gives the Tree evaluation API (root_node, size, outputs, get_subtree,
+    calc_*). Convert with from_tree and to_tree to use the Tree methods
+    which change the tree structure.
+    """
+    __slots__ = ('symbols', 'codes', 'lefts', 'rights', 'parents', 'sizes',
+        'node_outputs', 'node_optimals', 'node_optimals_masks',
+        'wrong_counts', 'twos_counts', 'total_wrongs', 'ban_rules')
+
+    def __init__(self, symbols):
+        self.symbols = symbols
+
+        self.codes = array('H')
+        self.lefts = array(INDEX_TYPECODE)
+        self.rights = array(INDEX_TYPECODE)
+        self.parents = array(INDEX_TYPECODE)
+        self.sizes = array(INDEX_TYPECODE)
+
+        self.node_outputs = None
+        self.node_optimals = None
+        self.node_optimals_masks = None
+
+        self.wrong_counts = None
+        self.twos_counts = None
+
+        self.total_wrongs = 0
+        self.ban_rules = IndexBanRules()
+
+    @classmethod
+    def from_tree(cls, tree, symbols=None):
+        """Returns the FlatTree of a Tree. Node outputs are not kept."""
+
+        if symbols is None:
+            symbols = SymbolTable(tree.root_node.problem_data)
+
+        flat_tree = cls(symbols)
+        nodes = []
+
+        # gather nodes in prefix order
+        to_explore = [tree.root_node]
+        while len(to_explore) > 0:
+            node = to_explore.pop()
+            nodes.append(node)
+
+            if node.left_child != None:
+                to_explore.append(node.right_child)
+                to_explore.append(node.left_child)
+
+        i_nodes = {id(node):i_node for i_node, node in enumerate(nodes)}
+
+        for node in nodes:
+            flat_tree.codes.append(symbols.get_code(node))
+
+            if node.left_child == None:
+                flat_tree.lefts.append(-1)
+                flat_tree.rights.append(-1)
+            else:
+                flat_tree.lefts.append(i_nodes[id(node.left_child)])
+                flat_tree.rights.append(i_nodes[id(node.right_child)])
+
+        flat_tree.parents = array(INDEX_TYPECODE, [-1]) * len(nodes)
+        for i_node, i_left in enumerate(flat_tree.lefts):
+            if i_left >= 0:
+                flat_tree.parents[i_left] = i_node
+                flat_tree.parents[flat_tree.rights[i_node]] = i_node
+
+        flat_tree.calc_nodes_count_nodes_below()
+        return flat_tree
+
+    def to_tree(self):
+        """Returns the Tree of this FlatTree, with nodes in prefix order.
+        Node outputs are not kept.
+        """
+        problem_data = self.symbols.problem_data
+
+        if problem_data.is_boolean:
+            node_constructor = NodeBoolean
+        else:
+            node_constructor = NodeInteger
+
+        tree = Tree()
+        for code in self.codes:
+            node = node_constructor(problem_data)
+            node.type, node.name, node.operator = self.symbols.symbols[code]
+            tree.append(node)
+
+        for i_node, node in enumerate(tree):
+            node.nodes_below_count = self.sizes[i_node]
+
+            if self.lefts[i_node] >= 0:
+                node.left_child = tree[self.lefts[i_node]]
+                node.right_child = tree[self.rights[i_node]]
+
+                node.left_child.parent = node
+                node.right_child.parent = node
+
+        return tree
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i_node):
+        return FlatNode(self, i_node)
+
+    def __iter__(self):
+        for i_node in range(len(self)):
+            yield FlatNode(self, i_node)
+
+    def __str__(self):
+        return self.subtree_str(0)
+
+    def subtree_str(self, i_node):
+        """Returns the string of the subtree rooted at i_node."""
+        symbols = self.symbols.symbols
+        parts = []
+        to_write = [i_node]
+
+        while len(to_write) > 0:
+            item = to_write.pop()
+
+            # punctuation
+            if isinstance(item, str):
+                parts.append(item)
+                continue
+
+            node_type, name, _ = symbols[self.codes[item]]
+            parts.append(name)
+
+            if node_type == 'op':
+                to_write += [')', self.rights[item], ',', self.lefts[item], '(']
+
+        return ''.join(parts)
+
+    @property
+    def root_node(self):
+        """Returns the root node at index position 0."""
+        return FlatNode(self, 0)
+
+    @property
+    def size(self):
+        return len(self)
+
+    @property
+    def outputs(self):
+        if self.node_outputs is None:
+            return None
+        return self.node_outputs[0]
+
+    @property
+    def optimals(self):
+        if self.node_optimals is None:
+            return None
+        return self.node_optimals[0]
+
+    def calc_max_depth(self):
+        """Calculates tree depth."""
+        depths = [0] * len(self)
+
+        # parents come before their children in prefix order
+        for i_node in range(1, len(self)):
+            depths[i_node] = depths[self.parents[i_node]] + 1
+
+        return max(depths)
+
+    def clear_all_outputs(self):
+        """Clear all output arrays in all nodes."""
+        self.node_outputs = None
+
+    def calc_all_outputs(self):
+        """Re-calculates output arrays for all nodes."""
+        arg_vals = self.symbols.problem_data.arg_vals
+        symbols = self.symbols.symbols
+        outputs = [None] * len(self)
+
+        # children come after their parents in prefix order
+        for i_node in range(len(self)-1, -1, -1):
+            node_type, name, operator = symbols[self.codes[i_node]]
+
+            if node_type == 'arg':
+                outputs[i_node] = arg_vals[name]
+            else:
+                outputs[i_node] = operator(
+                    outputs[self.lefts[i_node]], outputs[self.rights[i_node]])
+
+        self.node_outputs = outputs
+
+    def calc_all_optimals(self):
+        """Re-calculates optimal arrays for all nodes."""
+        problem_data = self.symbols.problem_data
+        symbols = self.symbols.symbols
+
+        optimals = [None] * len(self)
+        optimals_masks = [None] * len(self)
+
+        # the root is given targets as optimals
+        if problem_data.is_boolean:
+            optimals[0] = problem_data.target_outputs
+            optimals_masks[0] = bitarray(len(optimals[0]))
+            optimals_masks[0].setall(False)
+        else:
+            optimals[0] = problem_data.target_optimals
+
+        for i_node in range(len(self)):
+            i_left = self.lefts[i_node]
+            if i_left < 0:
+                continue
+
+            i_right = self.rights[i_node]
+            operator = symbols[self.codes[i_node]][2]
+
+            if problem_data.is_boolean:
+                rev_op = problem_data.op_reverse[operator]
+
+                optimals[i_left], optimals_masks[i_left] = rev_op(
+                    optimals[i_node], optimals_masks[i_node],
+                    self.node_outputs[i_right])
+
+                optimals[i_right], optimals_masks[i_right] = rev_op(
+                    optimals[i_node], optimals_masks[i_node],
+                    self.node_outputs[i_left])
+
+            else:
+                rev_table = problem_data.op_reverse[operator]
+
+                optimals[i_left] = rev_table[optimals[i_node],
+                    self.node_outputs[i_right], problem_data_integer.SIDE_LEFT]
+
+                optimals[i_right] = rev_table[optimals[i_node],
+                    self.node_outputs[i_left], problem_data_integer.SIDE_RIGHT]
+
+        self.node_optimals = optimals
+        self.node_optimals_masks = optimals_masks
+
+    def calc_nodes_count_wrongs(self):
+        """Calculate all node errors."""
+        if self.symbols.problem_data.is_boolean:
+            self.wrong_counts = [problem_data_boolean.count_wrongs(
+                outputs, optimals, optimals_mask)
+                for outputs, optimals, optimals_mask in zip(self.node_outputs,
+                    self.node_optimals, self.node_optimals_masks)]
+        else:
+            self.wrong_counts = [problem_data_integer.count_wrongs(
+                outputs, optimals)
+                for outputs, optimals in zip(self.node_outputs,
+                    self.node_optimals)]
+
+        self.total_wrongs = sum(self.wrong_counts)
+
+    def calc_nodes_count_twos(self):
+        """Count number of hashes in each node optimal array."""
+        if self.symbols.problem_data.is_boolean:
+            self.twos_counts = [problem_data_boolean.count_twos(optimals_mask)
+                for optimals_mask in self.node_optimals_masks]
+        else:
+            self.twos_counts = [problem_data_integer.count_twos(optimals)
+                for optimals in self.node_optimals]
+
+    def calc_nodes_count_nodes_below(self):
+        """For each node, calculate the number of subrooted node(s)."""
+        sizes = array(INDEX_TYPECODE, [1]) * len(self)
+
+        # children come after their parents in prefix order
+        for i_node in range(len(self)-1, 0, -1):
+            sizes[self.parents[i_node]] += sizes[i_node]
+
+        self.sizes = sizes
+
+    def get_subtree(self, subroot_node):
+        """Return the subtree rooted at subroot_node (a FlatNode or an
+        index position). Node outputs are shared, not copied.
+        """
+        if isinstance(subroot_node, FlatNode):
+            i_subroot = subroot_node.i_node
+        else:
+            i_subroot = subroot_node
+
+        i_stop = i_subroot + self.sizes[i_subroot]
+
+        sub_tree = FlatTree(self.symbols)
+        sub_tree.codes = self.codes[i_subroot:i_stop]
+        sub_tree.sizes = self.sizes[i_subroot:i_stop]
+
+        # shift the indexes, keeping -1 for none
+        sub_tree.lefts = array(INDEX_TYPECODE, [i_child - i_subroot if i_child >= 0
+            else -1 for i_child in self.lefts[i_subroot:i_stop]])
+        sub_tree.rights = array(INDEX_TYPECODE, [i_child - i_subroot if i_child >= 0
+            else -1 for i_child in self.rights[i_subroot:i_stop]])
+        sub_tree.parents = array(INDEX_TYPECODE, [-1] + [i_parent - i_subroot
+            for i_parent in self.parents[i_subroot+1:i_stop]])
+
+        if self.node_outputs is not None:
+            sub_tree.node_outputs = self.node_outputs[i_subroot:i_stop]
+
+        return sub_tree
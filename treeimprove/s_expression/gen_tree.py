@@ -1,5 +1,7 @@
-import copy
 import itertools
+import multiprocessing
+import concurrent.futures
+import numpy as np
 
 from .tree import Tree
 from ..improve import subtree_crossover
@@ -92,9 +94,9 @@ def get_all_tree_structures(max_depth, problem_data, node_constructor):
     tripplet_tree += [root_node, left_node, right_node]
 
     # generate remaining tree structures given max_depth
-    unprocessed_trees = [copy.deepcopy(single_node_tree)]
-    generated_trees = [copy.deepcopy(single_node_tree)]
-    generated_trees_str = set([str(copy.deepcopy(single_node_tree))])
+    unprocessed_trees = [single_node_tree.copy()]
+    generated_trees = [single_node_tree.copy()]
+    generated_trees_str = set([str(single_node_tree)])
 
     while len(unprocessed_trees) != 0:
         orig_master_tree = unprocessed_trees.pop()
@@ -105,14 +107,11 @@ def get_all_tree_structures(max_depth, problem_data, node_constructor):
         
         # loop leaf nodes
         for leaf_i_node in leaf_i_nodes:
-            master_tree = copy.deepcopy(orig_master_tree)
+            master_tree = orig_master_tree.copy()
             
-            # make copies of all trees involved
-            insert_tree = copy.deepcopy(tripplet_tree)
-            
-            # insert tree
+            # insert tree, subtree_crossover copies tripplet_tree itself
             new_master_tree, _ = subtree_crossover(
-                master_tree, leaf_i_node, insert_tree)
+                master_tree, leaf_i_node, tripplet_tree)
 
             tree_depth = new_master_tree.calc_max_depth()
 
@@ -123,52 +122,428 @@ def get_all_tree_structures(max_depth, problem_data, node_constructor):
 
     return generated_trees
 
+def is_canonical_tree(tree, commutative_operators):
+    """Returns True if the children of every commutative operator node in
+    tree are in canonical order (left subtree string <= right subtree
+    string). Swapping them gives the same outputs.
+    """
+    for node in tree:
+        if node.type == 'op' and node.operator in commutative_operators:
+            if str(node.left_child) > str(node.right_child):
+                return False
+
+    return True
+
 def gen_all_depth_trees(max_depth, problem_data, node_constructor, max_num_trees=40000):
-    """Returns all (or limited by max_num_trees) unique trees up to max_depth."""
+    """Returns all (or limited by max_num_trees) unique trees up to max_depth.
+    Commutative operators only get canonically ordered children.
+    """
+    return list(iter_all_depth_trees(
+        max_depth, problem_data, node_constructor, max_num_trees))
+
+def get_structure_i_nodes(raw_tree):
+    """Returns the indexes of the leaf nodes and of the nonleaf nodes
+    of a tree structure.
+    """
+    leaf_i_nodes = []
+    nonleaf_i_nodes = []
+
+    # identify all leaf nodes and nonleaf nodes
+    for i_node, node in enumerate(raw_tree):
+        if node.left_child == None:
+            leaf_i_nodes.append(i_node)
+        else:
+            nonleaf_i_nodes.append(i_node)
+
+    return leaf_i_nodes, nonleaf_i_nodes
+
+def set_leaf_values(tree, leaf_i_nodes, leaf_vals):
+    """Sets the argument names of the leaf nodes of tree."""
+    for leaf_i_node, leaf_val in zip(leaf_i_nodes, leaf_vals):
+        tree[leaf_i_node].type = 'arg'
+        tree[leaf_i_node].name = leaf_val
+
+def set_nonleaf_values(tree, nonleaf_i_nodes, nonleaf_vals):
+    """Sets the operators of the nonleaf nodes of tree."""
+    for nonleaf_i_node, nonleaf_val in zip(nonleaf_i_nodes, nonleaf_vals):
+        tree[nonleaf_i_node].type = 'op'
+        tree[nonleaf_i_node].operator = nonleaf_val
+        tree[nonleaf_i_node].name = nonleaf_val.__name__
+
+def iter_structure_values(raw_tree, problem_data):
+    """Sets each combination of argument and operator values on the nodes
+    of raw_tree in place and yields its (leaf values, nonleaf values).
+    Commutative operators only get canonically ordered children.
+    """
+    commutative_operators = getattr(problem_data, 'commutative_operators', set())
+    leaf_i_nodes, nonleaf_i_nodes = get_structure_i_nodes(raw_tree)
+
+    arguments = problem_data.arguments
+    num_leaf_vals = len(arguments)**len(leaf_i_nodes)
+
+    # given number of nonleaf nodes, make all nonleaf node values
+    all_nonleaf_vals = [list(seq) for seq in itertools.product(
+        problem_data.operators, repeat=len(nonleaf_i_nodes))]
+
+    for i_leaf_vals in range(num_leaf_vals):
+
+        # leaf node values of the combination index, last leaf fastest
+        leaf_vals = []
+        for _ in leaf_i_nodes:
+            i_leaf_vals, i_argument = divmod(i_leaf_vals, len(arguments))
+            leaf_vals.append(arguments[i_argument])
+        leaf_vals.reverse()
+
+        set_leaf_values(raw_tree, leaf_i_nodes, leaf_vals)
+
+        for nonleaf_vals in all_nonleaf_vals:
+            set_nonleaf_values(raw_tree, nonleaf_i_nodes, nonleaf_vals)
+
+            if is_canonical_tree(raw_tree, commutative_operators):
+                yield leaf_vals, nonleaf_vals
+
+def iter_all_depth_trees(max_depth, problem_data, node_constructor, max_num_trees=40000):
+    """Yields the trees of gen_all_depth_trees one at a time, so that 
+    they can be added to an archive without holding all of them.
+    """
     # generate raw structural trees only
     raw_trees = get_all_tree_structures(max_depth, problem_data, node_constructor)
 
-    all_trees = []
+    num_trees = 0
     for raw_tree in raw_trees:
 
-        leaf_i_nodes = []
-        nonleaf_i_nodes = []
-        
-        # identify all leaf nodes and nonleaf nodes
-        for i_node, node in enumerate(raw_tree):
-            if node.left_child == None:
-                leaf_i_nodes.append(i_node)
-            else:
-                nonleaf_i_nodes.append(i_node)
+        # values are set on the raw structure, trees are copies of it
+        for _ in iter_structure_values(raw_tree, problem_data):
+            yield raw_tree.copy()
+
+            num_trees += 1
+            if num_trees == max_num_trees:
+                return
+
+def get_semantic_rows(problem_data, names):
+    """Returns the output arrays of the named arguments as a matrix with
+    one row per argument, plus a row mask used to clear padding.
+
+    In the Boolean case the rows are packed bytes (see pack_rows) and
+    the mask clears the padding bits which negating operators set. In
+    the integer case the rows are the output values themselves.
+    """
+    arg_outputs = [problem_data.arg_vals[name] for name in names]
+
+    if problem_data.is_boolean:
+        from bitarray import bitarray
+        from ..problem_data.problem_data_boolean import pack_rows
+
+        num_cases = len(arg_outputs[0])
+        rows = pack_rows(arg_outputs).copy()
+        row_mask = pack_rows([bitarray('1'*num_cases)])[0]
+
+    else:
+        rows = np.array(arg_outputs, dtype=np.uint8)
+        row_mask = None
+
+    return rows, row_mask
+
+def build_semantic_tree(i_entry, entries, problem_data, node_constructor, tree):
+    """Appends the nodes of entry i_entry (root first) onto tree and
+    returns the root node of the appended subtree.
+    """
+    operator, left_entry, right_entry, _ = entries[i_entry]
+
+    node = node_constructor(problem_data)
+    tree.append(node)
+
+    if left_entry == None:
+        node.type = 'arg'
+        node.name = operator
+        return node
+
+    node.type = 'op'
+    node.operator = operator
+    node.name = operator.__name__
+
+    node.left_child = build_semantic_tree(
+        left_entry, entries, problem_data, node_constructor, tree)
+    node.right_child = build_semantic_tree(
+        right_entry, entries, problem_data, node_constructor, tree)
 
-        # given number of leaf nodes, make all leaf node values
-        all_leaf_vals = [list(seq) for seq in itertools.product(
-            problem_data.arguments, repeat=len(leaf_i_nodes))]
+    node.left_child.parent = node
+    node.right_child.parent = node
 
-        # given number of nonleaf nodes, make all nonleaf node values
-        all_nonleaf_vals = [list(seq) for seq in itertools.product(
-            problem_data.operators, repeat=len(nonleaf_i_nodes))]
+    return node
 
-        # make a trees from raw structure
-        for leaf_vals in all_leaf_vals:
-            for nonleaf_vals in all_nonleaf_vals:
-                tree = copy.deepcopy(raw_tree)
+def get_pair_chunks(depth_start, num_entries, commutative_flag, pair_bytes,
+    max_chunk_bytes):
+    """Yields the (left entries, right entries, valid) chunks of child
+    pairs to combine at a depth, where entries from depth_start onwards
+    are those of the previous depth. Every pair has at least one child
+    from the previous depth. valid masks out the pairs of a chunk which
+    are not combined, or is None if all of them are.
 
-                # set properties of leaf nodes
-                for leaf_i_node, leaf_val in zip(leaf_i_nodes, leaf_vals):
-                    tree[leaf_i_node].type = 'arg'
-                    tree[leaf_i_node].name = leaf_val
+    With commutative_flag only pairs with left entry <= right entry are
+    given, the swapped pair gives the same outputs.
 
-                # set properties of nonleaf nodes
-                for nonleaf_i_node, nonleaf_val in zip(nonleaf_i_nodes, nonleaf_vals):
-                    tree[nonleaf_i_node].type = 'op'
-                    tree[nonleaf_i_node].operator = nonleaf_val
-                    tree[nonleaf_i_node].name = nonleaf_val.__name__
+    Chunks are made as they are consumed, the entry arrays of all chunks
+    are slices of one array, so only the chunks being combined take
+    memory.
+    """
+    all_entries = np.arange(num_entries)
+
+    if commutative_flag:
+        left_start = 0
+        while left_start < num_entries:
+            right_entries = all_entries[max(left_start, depth_start):]
+            left_step = max(1, max_chunk_bytes // (len(right_entries) * pair_bytes))
+
+            chunk_entries = all_entries[left_start:left_start+left_step]
+            left_start += left_step
+
+            valid = None
+            if chunk_entries[-1] > right_entries[0]:
+                valid = right_entries[None] >= chunk_entries[:, None]
+
+            yield chunk_entries, right_entries, valid
+
+        return
+
+    # pairs with a left child from the previous depth, then pairs
+    # with only a right child from the previous depth
+    pair_sets = [
+        (all_entries[depth_start:], all_entries),
+        (all_entries[:depth_start], all_entries[depth_start:]),
+    ]
+
+    for left_entries, right_entries in pair_sets:
+        if len(right_entries) == 0:
+            continue
+
+        left_step = max(1, max_chunk_bytes // (len(right_entries) * pair_bytes))
+
+        for left_start in range(0, len(left_entries), left_step):
+            yield left_entries[left_start:left_start+left_step], right_entries, None
+
+def get_chunk_firsts(rows, row_mask, sizes, operators, chunk_entries,
+    right_entries, valid):
+    """Combines one chunk of child pairs (see get_pair_chunks) with every
+    operator. Candidates are ordered (left child, right child, operator),
+    for the first smallest candidate of each output array of the chunk
+    returns, in candidate order, the (outputs, sizes, operator indexes,
+    left entries, right entries) arrays.
+    """
+    row_bytes = rows.shape[1]
+
+    outputs = np.stack([operator(rows[chunk_entries, None],
+        rows[None, right_entries]) for operator in operators], axis=2)
+    if row_mask is not None:
+        outputs &= row_mask
+    outputs = outputs.reshape(-1, row_bytes)
+
+    candidate_sizes = np.repeat((1 + sizes[chunk_entries, None] +
+        sizes[None, right_entries]).ravel(), len(operators))
+
+    if valid is None:
+        order = np.argsort(candidate_sizes, kind='stable')
+    else:
+        candidates = np.flatnonzero(
+            np.repeat(valid.ravel(), len(operators)))
+        order = candidates[np.argsort(
+            candidate_sizes[candidates], kind='stable')]
+
+    # first smallest candidate of each output array in the chunk
+    keys = outputs.view(np.dtype((np.void, row_bytes))).ravel()
+    _, first = np.unique(keys[order], return_index=True)
+    positions = np.sort(order[first])
+
+    i_pairs, i_operators = np.divmod(positions, len(operators))
+    i_lefts, i_rights = np.divmod(i_pairs, len(right_entries))
+
+    return (outputs[positions], candidate_sizes[positions], i_operators,
+        chunk_entries[i_lefts], right_entries[i_rights])
+
+# state of each process of the parallel mode of iter_semantic_trees
+WORKER_STATE = {}
+
+def init_semantic_worker(rows, row_mask, sizes):
+    """Pool initializer of the parallel mode of iter_semantic_trees, holds
+    the output rows and sizes of the entries of one depth.
+    """
+    WORKER_STATE['rows'] = rows
+    WORKER_STATE['row_mask'] = row_mask
+    WORKER_STATE['sizes'] = sizes
+
+def get_chunk_firsts_task(operators, chunk_entries, right_entries, valid):
+    """Runs get_chunk_firsts in a worker process, on the rows held by
+    init_semantic_worker.
+    """
+    return get_chunk_firsts(WORKER_STATE['rows'], WORKER_STATE['row_mask'],
+        WORKER_STATE['sizes'], operators, chunk_entries, right_entries, valid)
+
+def iter_chunks_firsts(rows, row_mask, sizes, operators, pair_chunks,
+    executor=None, num_workers=1):
+    """Yields the get_chunk_firsts result of each of pair_chunks, in order.
+    If executor (made with init_semantic_worker) is given, num_workers
+    chunks at a time are handed to its processes, the one being consumed
+    included.
+    """
+    if executor == None:
+        for chunk_entries, right_entries, valid in pair_chunks:
+            yield get_chunk_firsts(rows, row_mask, sizes, operators,
+                chunk_entries, right_entries, valid)
+        return
+
+    pair_chunks = iter(pair_chunks)
+    futures = []
+
+    while True:
+        for chunk_entries, right_entries, valid in itertools.islice(
+            pair_chunks, num_workers - len(futures)):
+            futures.append(executor.submit(get_chunk_firsts_task, operators,
+                chunk_entries, right_entries, valid))
+
+        if not futures:
+            return
+
+        yield futures.pop(0).result()
+
+def gen_semantic_trees(max_depth, problem_data, node_constructor,
+    max_num_trees=None, max_bytes=2**30, max_chunk_bytes=2**24,
+    num_workers=1):
+    """Returns the trees of iter_semantic_trees as a list."""
+    return list(iter_semantic_trees(max_depth, problem_data, node_constructor,
+        max_num_trees, max_bytes, max_chunk_bytes, num_workers))
+
+def iter_semantic_trees(max_depth, problem_data, node_constructor,
+    max_num_trees=None, max_bytes=2**30, max_chunk_bytes=2**24,
+    num_workers=1):
+    """Yields one tree per unique output array reachable with trees up to
+    max_depth (a single node has depth 0), built bottom-up by depth
+    (observational equivalence).
+
+    Each depth only combines the unique output arrays found at lower
+    depths, with at least one child from the previous depth, and only
+    in one child order for commutative operators. An output
+    array keeps the first depth it is found at and the smallest tree of
+    that depth. Output arrays are enumerated as compact entries first,
+    trees are then built one at a time as they are consumed.
+
+    The chunks of child pairs of a depth can be combined by a pool of
+    num_workers processes (all cores if None). Their results are merged in
+    chunk order, so the trees are the same whatever the number of workers.
+
+    Arguments:
+    max_num_trees -- stop once this many unique trees have been found.
+    max_bytes -- stop once the stored output rows exceed this many bytes.
+    max_chunk_bytes -- bound on the temporary arrays of one combination step.
+    num_workers -- number of processes combining the chunks of child pairs.
+    """
+    if num_workers == None:
+        num_workers = multiprocessing.cpu_count()
+
+    names = list(problem_data.arguments)
+    rows, row_mask = get_semantic_rows(problem_data, names)
+    row_bytes = rows.shape[1]
+
+    # (operator or argument name, left entry, right entry, size)
+    entries = []
+    entry_depths = []
+    seen = {}
+
+    # single node trees
+    kept_rows = []
+    for i_row, (name, row) in enumerate(zip(names, rows)):
+        key = row.tobytes()
+        if key in seen:
+            continue
+
+        seen[key] = len(entries)
+        entries.append((name, None, None, 1))
+        entry_depths.append(0)
+        kept_rows.append(i_row)
+
+    rows = rows[kept_rows]
+
+    def budget_reached():
+        if max_num_trees != None and len(entries) >= max_num_trees:
+            return True
+        return len(entries) * row_bytes >= max_bytes
+
+    depth_start = 0
+    for depth in range(1, max_depth+1):
+        if budget_reached():
+            break
+
+        num_entries = len(entries)
+        sizes = np.array([entry[3] for entry in entries], dtype=np.int64)
+        new_rows = []
+
+        # commutative operators only combine canonically ordered pairs
+        commutative_operators = getattr(
+            problem_data, 'commutative_operators', set())
+
+        operator_groups = [
+            [op for op in problem_data.operators if op in commutative_operators],
+            [op for op in problem_data.operators if op not in commutative_operators],
+        ]
+
+        # the processes of a depth hold its rows, from when they start
+        executor = None
+        if num_workers > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(num_workers,
+                initializer=init_semantic_worker,
+                initargs=(rows, row_mask, sizes))
+
+        try:
+            for operators in operator_groups:
+                if len(operators) == 0 or budget_reached():
+                    continue
+
+                # every operator of the group is applied to each chunk of
+                # pairs at once so that a budget cuts all operators evenly
+                pair_chunks = get_pair_chunks(depth_start, num_entries,
+                    operators[0] in commutative_operators,
+                    len(operators) * row_bytes, max_chunk_bytes)
+
+                for chunk_firsts in iter_chunks_firsts(rows, row_mask, sizes,
+                    operators, pair_chunks, executor, num_workers):
 
-                all_trees.append(tree)
+                    for row, size, i_operator, left_entry, right_entry in zip(
+                        *chunk_firsts):
 
-                if len(all_trees) == max_num_trees:
-                    return all_trees
+                        key = row.tobytes()
+                        candidate = (operators[i_operator], int(left_entry),
+                            int(right_entry), int(size))
+
+                        i_entry = seen.get(key)
+
+                        if i_entry == None:
+                            seen[key] = len(entries)
+                            entries.append(candidate)
+                            entry_depths.append(depth)
+                            new_rows.append(row)
+
+                            if budget_reached():
+                                break
+
+                        # a smaller tree of the same depth replaces the old one
+                        elif (entry_depths[i_entry] == depth and
+                            candidate[3] < entries[i_entry][3]):
+                            entries[i_entry] = candidate
+
+                    if budget_reached():
+                        break
+
+        finally:
+            if executor != None:
+                executor.shutdown(cancel_futures=True)
+
+        if len(new_rows) == 0:
+            break
 
-    return all_trees
+        depth_start = num_entries
+        rows = np.concatenate([rows, np.array(new_rows, dtype=rows.dtype)])
 
+    # turn entries into trees
+    for i_entry in range(len(entries)):
+        tree = Tree()
+        build_semantic_tree(i_entry, entries, problem_data, node_constructor, tree)
+        yield tree
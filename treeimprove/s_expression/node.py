@@ -1,8 +1,17 @@
 import random
+import numpy as np
 from bitarray import bitarray
 
+from ..problem_data import problem_data_boolean
+from ..problem_data import problem_data_integer
+
 class BaseNode(object):
     """This class is inheristed by the other node constructor calsses."""
+    __slots__ = ('parent', 'left_child', 'right_child', 'outputs', 
+        'optimals', 'optimals_mask', 'wrong_count', 'twos_count', 
+        'type', 'name', 'operator', 'nodes_below_count', 'single_child_arg', 
+        'problem_data')
+
     def __init__(self, problem_data):
         self.parent = None
         self.left_child = None
@@ -59,8 +68,8 @@ class BaseNode(object):
         """Generate the output array for the node. 
         Recursively calls child dependencies first."""
 
-        # if the outputs list is not empty, give the outputs
-        if self.outputs != None:
+        # if the outputs array is not empty, give the outputs
+        if self.outputs is not None:
             return self.outputs
 
         if self.type == 'arg':
@@ -103,6 +112,19 @@ class BaseNode(object):
             self.name = chosen.__name__
             self.operator = chosen
 
+    def recalc_optimals(self):
+        """Re-calculates the optimals of the node from up to date parent
+        optimals and sibling outputs. Returns True if they changed.
+        """
+        old_optimals = self.optimals
+        old_optimals_mask = self.optimals_mask
+
+        self.optimals = None
+        self.optimals_mask = None
+        self.calc_optimals()
+
+        return not self.same_optimals(old_optimals, old_optimals_mask)
+
     def count_nodes_below(self):
         """Counts the number of nodes found in the 
         subtree rooted by this (self) node.
@@ -123,6 +145,7 @@ class NodeBoolean(BaseNode):
     """Extends BaseNode by implementing or overwriting methods
     which are specific to the Boolean case.
     """
+    __slots__ = ()
 
     def calc_optimals(self):
         """Generate the optimals array for the node. 
@@ -133,14 +156,13 @@ class NodeBoolean(BaseNode):
             self.optimals = self.problem_data.target_outputs
 
             # dont mask any optimal
-            self.optimals_mask = bitarray([False]*len(self.optimals))
+            self.optimals_mask = bitarray(len(self.optimals))
+            self.optimals_mask.setall(False)
             return self.optimals, self.optimals_mask
 
-        if self.optimals != None:
+        if self.optimals is not None:
             return self.optimals, self.optimals_mask
 
-        me_left_flag = False
-
         # check for self is the left child
         if self.parent.left_child == self:
             b_outputs = self.parent.right_child.outputs
@@ -149,48 +171,22 @@ class NodeBoolean(BaseNode):
             b_outputs = self.parent.left_child.outputs
 
         rev_op = self.problem_data.op_reverse[self.parent.operator]
-        A_optimals = self.parent.optimals
-        A_optimal_masks = self.parent.optimals_mask
-
-        # fill in optimal array and mask for hash values
-        self.optimals = [False]*len(A_optimals)
-        self.optimals_mask = [False]*len(A_optimals)
-
-        for i in range(len(A_optimals)):
-
-            # check for A optimal is hash
-            A_mask = A_optimal_masks[i]
-            if A_mask:
-                self.optimals_mask[i] = True
-                continue
-
-            A_optimal = A_optimals[i]
-            b_output = b_outputs[i]
 
-            optimal = rev_op(A_optimal, b_output)
-            
-            if optimal == 2:
-                self.optimals_mask[i] = True
-                continue
+        # compute optimal array and mask for all fitness cases at once
+        self.optimals, self.optimals_mask = rev_op(
+            self.parent.optimals, self.parent.optimals_mask, b_outputs)
 
-            self.optimals[i] = optimal
-
-        self.optimals = bitarray(self.optimals)
-        self.optimals_mask = bitarray(self.optimals_mask)
         return self.optimals, self.optimals_mask
 
+    def same_optimals(self, optimals, optimals_mask):
+        """Returns True if the node optimals equal optimals and mask."""
+        return self.optimals == optimals and self.optimals_mask == optimals_mask
+
     def count_wrongs(self):
         """Counts the number of errors in the output array of this node."""
 
-        self.wrong_count = 0
-        for output, optimal, mask in zip(
-            self.outputs, self.optimals, self.optimals_mask):
-            
-            if mask:
-                continue
-            if output != optimal:
-                self.wrong_count += 1
-
+        self.wrong_count = problem_data_boolean.count_wrongs(
+            self.outputs, self.optimals, self.optimals_mask)
         return self.wrong_count
 
     def count_twos(self):
@@ -198,13 +194,17 @@ class NodeBoolean(BaseNode):
         of this node.
         """
 
-        self.twos_count = self.optimals_mask.count(True)
+        self.twos_count = problem_data_boolean.count_twos(self.optimals_mask)
         return self.twos_count
         
 class NodeInteger(BaseNode):
     """Extends BaseNode by implementing or overwriting methods
     which are specific to the finite algebra (integer) case.
+
+    Optimals are stored as an array of optimal sets, each one a bitmask
+    of the values which are acceptable for a fitness case.
     """
+    __slots__ = ()
 
     def calc_optimals(self):
         """Generate the optimals array for the node. 
@@ -212,46 +212,36 @@ class NodeInteger(BaseNode):
 
         # if the node is root, give targets as optimals
         if self.parent == None:
-            self.optimals = self.problem_data.target_outputs
+            self.optimals = self.problem_data.target_optimals
             return self.optimals
 
-        if self.optimals:
+        if self.optimals is not None:
             return self.optimals
 
         # check for self is the left child
         if self.parent.left_child == self:
             b_outputs = self.parent.right_child.outputs
-            is_left = True
+            side = problem_data_integer.SIDE_LEFT
 
         else:
             b_outputs = self.parent.left_child.outputs
-            is_left = False
-
-        rev_op = self.problem_data.op_reverse[self.parent.operator]
-        A_optimals = self.parent.optimals
+            side = problem_data_integer.SIDE_RIGHT
 
-        self.optimals = []
-        for A_optimal, b_output in zip(A_optimals, b_outputs):
-            optimal = rev_op(A_optimal, b_output, is_left=is_left)
-            self.optimals.append(optimal)
+        # gather the optimal sets of all fitness cases at once
+        rev_table = self.problem_data.op_reverse[self.parent.operator]
+        self.optimals = rev_table[self.parent.optimals, b_outputs, side]
 
         return self.optimals
 
+    def same_optimals(self, optimals, optimals_mask=None):
+        """Returns True if the node optimal sets equal optimals."""
+        return optimals is not None and np.array_equal(self.optimals, optimals)
+
     def count_wrongs(self):
         """Counts the number of errors in the output array of this node."""
 
-        self.wrong_count = 0
-
-        for out, optimal in zip(self.outputs, self.optimals):
-
-            if isinstance(optimal, tuple):
-                if out not in optimal:
-                    self.wrong_count += 1
-
-            else:
-                if out != optimal:
-                    self.wrong_count += 1
-
+        self.wrong_count = problem_data_integer.count_wrongs(
+            self.outputs, self.optimals)
         return self.wrong_count
 
     def count_twos(self):
@@ -259,8 +249,5 @@ class NodeInteger(BaseNode):
         of this node.
         """
 
-        self.twos_count = 0
-        for optimal in self.optimals:
-            if isinstance(optimal, tuple):
-                self.twos_count += len(optimal)-1
+        self.twos_count = problem_data_integer.count_twos(self.optimals)
         return self.twos_count
@@ -114,21 +114,99 @@ class Tree(list):
             node.optimals = None
             node.optimals_mask = None
 
-        i_nodes = [0]
+        # walk down from the root following the child references
+        nodes = [self.root_node]
 
-        while len(i_nodes) > 0:
-            i_node = i_nodes.pop()
-            self[i_node].calc_optimals()
+        while len(nodes) > 0:
+            node = nodes.pop()
+            node.calc_optimals()
 
             # check for reached leaf node
-            if self[i_node].left_child == None:
+            if node.left_child == None:
+                continue
+
+            nodes.append(node.left_child)
+            nodes.append(node.right_child)
+
+    def calc_all_after_insert(self, subroot_node, removed_size, removed_wrongs):
+        """Incrementally re-evaluates a fully evaluated tree after a subtree
+        of removed_size nodes (with removed_wrongs errors in total) has been
+        replaced by the subtree rooted at subroot_node.
+
+        Only the nodes which depend on the change are re-calculated: the
+        outputs, errors and node counts up the path to the root, everything
+        within the new subtree, and the optimals (with errors and hashes) of
+        the nodes hanging off the path, going down only while the optimals 
+        change. The optimals of path nodes depend only on the root targets
+        and the outputs of off path siblings, so they stay the same.
+        """
+        self.calc_outputs_up(subroot_node)
+
+        # new subtree nodes, each after its parent
+        inserted_nodes = []
+        to_explore = [subroot_node]
+
+        while len(to_explore) > 0:
+            node = to_explore.pop()
+            node.optimals = None
+            node.optimals_mask = None
+            inserted_nodes.append(node)
+
+            if node.left_child != None:
+                to_explore.append(node.left_child)
+                to_explore.append(node.right_child)
+
+        total_wrongs = self.total_wrongs - removed_wrongs
+
+        for node in inserted_nodes:
+            node.calc_optimals()
+            node.count_wrongs()
+            node.count_twos()
+            total_wrongs += node.wrong_count
+
+        subroot_node.count_nodes_below()
+        size_change = subroot_node.nodes_below_count - removed_size
+
+        # walk up the path, gathering the off path siblings
+        to_recalc = []
+        node = subroot_node
+
+        while node.parent != None:
+            parent = node.parent
+
+            if parent.left_child == node:
+                to_recalc.append(parent.right_child)
+            else:
+                to_recalc.append(parent.left_child)
+
+            total_wrongs -= parent.wrong_count
+            total_wrongs += parent.count_wrongs()
+            parent.nodes_below_count += size_change
+
+            node = parent
+
+        # walk down from the off path siblings while optimals change
+        while len(to_recalc) > 0:
+            node = to_recalc.pop()
+
+            if not node.recalc_optimals():
                 continue
 
-            i_left = self.index(self[i_node].left_child)
-            i_right = self.index(self[i_node].right_child)
+            total_wrongs -= node.wrong_count
+            total_wrongs += node.count_wrongs()
+            node.count_twos()
+
+            if node.left_child != None:
+                to_recalc.append(node.left_child)
+                to_recalc.append(node.right_child)
 
-            i_nodes.append(i_left)
-            i_nodes.append(i_right)
+        self.total_wrongs = total_wrongs
+
+    def get_node_indexes(self):
+        """Returns a dict mapping the id of each node to its index
+        position, used in place of the O(n) list.index.
+        """
+        return {id(node):i_node for i_node, node in enumerate(self)}
 
     def calc_nodes_count_wrongs(self):
         """Calculate all node errors."""
@@ -146,6 +224,29 @@ class Tree(list):
         """For each node, calculate the number of subrooted node(s)."""
         self.root_node.count_nodes_below()
 
+    def copy(self):
+        """Returns a copy of the tree made of new nodes. Unlike 
+        copy.deepcopy, the output and optimal arrays and the problem 
+        data are shared with this tree rather than copied, they are 
+        never changed in place. The copy gets empty ban rules. Parent 
+        references to nodes outside of the tree are set to None.
+        """
+        new_nodes = {id(node):copy.copy(node) for node in self}
+
+        tree = Tree()
+        tree.total_wrongs = self.total_wrongs
+
+        for node in self:
+            new_node = new_nodes[id(node)]
+
+            new_node.parent = new_nodes.get(id(node.parent))
+            new_node.left_child = new_nodes.get(id(node.left_child))
+            new_node.right_child = new_nodes.get(id(node.right_child))
+
+            tree.append(new_node)
+
+        return tree
+
     def get_subtree(self, subroot_node):
         """Return the subtree rooted at subroot_node."""
         # gather all subtree nodes
@@ -162,13 +263,8 @@ class Tree(list):
             to_explore.append(node.left_child)
             to_explore.append(node.right_child)
 
-        # make copy of nodes in sub tree
-        sub_tree = copy.deepcopy(sub_tree)
-
-        # set subroot_node as root
-        sub_tree[0].parent = None
-
-        return sub_tree
+        # make copy of nodes in sub tree, subroot_node becomes the root
+        return sub_tree.copy()
 
     @property
     def size(self):
@@ -0,0 +1,583 @@
+import time
+
+import numpy as np
+from bitarray import bitarray
+
+from . import archive
+from . import improve
+from . import parallel
+from . import select
+from . import utilities
+from .problem_data.problem_data_boolean import ProblemDataBoolean
+from .problem_data.problem_data_integer import ProblemDataInteger
+from .s_expression import gen_tree
+from .s_expression.node import NodeBoolean, NodeInteger
+
+def load_boolean_problem(paramaters):
+    """Returns the Boolean problem data and node constructor."""
+    problem_data = ProblemDataBoolean(
+        paramaters['num_bits'], paramaters['benchmark_name'])
+
+    return problem_data, NodeBoolean
+
+def load_catagorical_problem(paramaters):
+    """Returns the catagorical (integer) problem data and node
+    constructor.
+    """
+    problem_data = ProblemDataInteger(paramaters['benchmark_name'])
+
+    return problem_data, NodeInteger
+
+# problem type name : (problem loader, boolean_flag)
+PROBLEM_TYPES = {
+    'boolean': (load_boolean_problem, True),
+    'catagorical': (load_catagorical_problem, False),
+}
+
+class Search(object):
+    """Base class of the search strategies.
+
+    Arguments:
+    paramaters -- run paramaters dict
+    problem_data -- problem data object
+    node_constructor -- node class of the problem type
+    boolean_flag -- True for Boolean problems.
+    """
+
+    alg_name = None
+
+    # optional paramaters the strategy cannot honour, rejected if set
+    unsupported_paramaters = []
+
+    @classmethod
+    def check_paramaters(cls, paramaters):
+        """Raises ValueError if paramaters sets an optional paramater the
+        strategy does not support.
+        """
+        unsupported = [name for name in cls.unsupported_paramaters
+            if paramaters.get(name)]
+
+        if unsupported:
+            raise ValueError('{} does not support {}, only GLTI does'.format(
+                cls.alg_name, ', '.join(unsupported)))
+
+    def __init__(self, paramaters, problem_data, node_constructor,
+        boolean_flag):
+        self.check_paramaters(paramaters)
+
+        self.paramaters = paramaters
+        self.problem_data = problem_data
+        self.node_constructor = node_constructor
+        self.boolean_flag = boolean_flag
+        self.verbose = paramaters['verbose']
+
+        self.max_archive_size = paramaters['max_archive_size']
+        self.archive_tree_deapth = None
+
+        self.tree_archive = None
+
+    def build_archive(self):
+        """Returns the filled tree archive."""
+        raise NotImplementedError
+
+    def init_master_tree(self):
+        """Returns the initial master tree, with all its statistics."""
+        raise NotImplementedError
+
+    def start(self, master_tree):
+        """Called once before the first step."""
+        pass
+
+    def step(self, master_tree):
+        """Makes one change to master_tree, returns the new master tree,
+        the index of the changed node and the status of the change.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Releases anything held by the search, called once at the end."""
+        pass
+
+class LTISearch(Search):
+    """Local tree improvement, one node at a time. Unvisited nodes are
+    tried in order, the first perfect or better option is taken, and
+    once all nodes are visited a visited node is changed anyway.
+    """
+
+    alg_name = 'LTI'
+
+    unsupported_paramaters = [
+        'archive_cache_dir', 'num_archive_workers', 'num_option_workers',
+        'num_archive_shards', 'num_search_threads',
+    ]
+
+    def build_archive(self):
+        # make unevaluated trees for archive
+        trees_uneval = [gen_tree.generate_full_tree(
+            2, self.problem_data, self.node_constructor) for i in range(2500)]
+
+        if self.verbose:
+            print('num pre-archive trees : ', len(trees_uneval))
+
+        # initiate archive and add trees_uneval, the Boolean archive also
+        # takes the subtrees of each tree
+        tree_archive = archive.TreeArchive(self.max_archive_size,
+            split_subtrees_flag=self.boolean_flag,
+            boolean_flag=self.boolean_flag)
+        tree_archive.populate_archive(trees_uneval)
+        tree_archive.gather_tree_outputs()
+
+        self.tree_archive = tree_archive
+        return tree_archive
+
+    def init_master_tree(self):
+        # generate master tree
+        master_tree = gen_tree.generate_full_tree(
+            self.paramaters.get('init_master_tree_depth', 2),
+            self.problem_data, self.node_constructor)
+
+        # calculate all statistics for master_tree
+        master_tree.calc_all_outputs()
+        master_tree.calc_all_optimals()
+
+        master_tree.calc_nodes_count_wrongs()
+        master_tree.calc_nodes_count_twos()
+
+        return master_tree
+
+    def start(self, master_tree):
+        # i_node : node_data
+        self.visited_nodes_data = {}
+        self.unvis_ordered_nodes = select.gen_init_unvis_ordered_nodes(
+            master_tree)
+
+    def restart(self, master_tree):
+        """Forgets the visited nodes after master_tree changed."""
+        self.visited_nodes_data = {}
+        self.unvis_ordered_nodes = select.gen_init_unvis_ordered_nodes(
+            master_tree)
+
+    def step(self, master_tree):
+        # pick an unvisited node to improve
+        i_node = select.select_unvisited_node(self.unvis_ordered_nodes)
+
+        # check for all nodes visited
+        if i_node == None:
+
+            # pick visited node to change
+            i_node, archtree, status = select.select_visited_node(
+                self.visited_nodes_data, len(master_tree), self.problem_data,
+                self.node_constructor)
+            master_tree = improve.update_master_tree(
+                master_tree, i_node, archtree)
+
+            self.restart(master_tree)
+            return master_tree, i_node, status
+
+        # get node change stratergy
+        node_data = improve.get_node_options(
+            i_node, master_tree, self.tree_archive, self.problem_data)
+
+        status = node_data['status']
+
+        # check for perfect solution
+        if status == improve.STATUS_PERFECT:
+            archtree = node_data['archtree']
+
+            master_tree = improve.update_master_tree(
+                master_tree, i_node, archtree)
+
+            self.restart(master_tree)
+            return master_tree, i_node, 'perfect'
+
+        # check for better solution
+        if status == improve.STATUS_BETTER:
+            better_arch_trees = node_data['better_arch_trees']
+            archtree = select.select_by_archtree_size(better_arch_trees)
+
+            master_tree = improve.update_master_tree(
+                master_tree, i_node, archtree)
+
+            self.restart(master_tree)
+            return master_tree, i_node, 'better'
+
+        # not perfect and not better
+        self.visited_nodes_data[i_node] = node_data
+
+        self.unvis_ordered_nodes = select.update_unvis_ordered_nodes(
+            i_node, self.unvis_ordered_nodes)
+
+        return master_tree, i_node, 'none'
+
+class GLTISearch(Search):
+    """Greedy local tree improvement (small-LTI). The archive holds one
+    tree per unique output array up to archive_tree_deapth, each step
+    finds the options of every node with wrong outputs in a single
+    archive pass and takes the smallest of the best ones.
+    """
+
+    alg_name = 'small-LTI'
+
+    def __init__(self, paramaters, problem_data, node_constructor,
+        boolean_flag):
+        super().__init__(
+            paramaters, problem_data, node_constructor, boolean_flag)
+
+        self.archive_tree_deapth = paramaters['archive_tree_deapth']
+
+        # budget of unique trees generated for the archive
+        self.archive_max_trees = paramaters.get('archive_max_trees', 40000)
+
+        # optional directory of saved archives
+        self.archive_cache_dir = paramaters.get('archive_cache_dir')
+
+        # optional number of processes building the archive trees, see
+        # gen_tree.iter_semantic_trees
+        self.num_archive_workers = paramaters.get('num_archive_workers', 1)
+
+        # optional number of processes sharing out the option search, by
+        # nodes or, if num_archive_shards is given, by archive shards
+        self.num_option_workers = paramaters.get('num_option_workers')
+        self.num_archive_shards = paramaters.get('num_archive_shards')
+
+        # optional number of threads sharing out the option search inside
+        # this process instead, on the archive outputs in place
+        self.num_search_threads = paramaters.get('num_search_threads')
+
+        self.options_pool = None
+
+    def build_archive(self):
+        # initiate archive, loading a saved one if available
+        tree_archive = archive.TreeArchive(
+            self.max_archive_size, split_subtrees_flag=False,
+            boolean_flag=self.boolean_flag, verbose=self.verbose)
+
+        if not tree_archive.load_cache(
+            self.archive_cache_dir, self.problem_data,
+            self.archive_tree_deapth, self.archive_max_trees):
+
+            # unevaluated trees for archive, one per unique output array,
+            # built lazily as the archive takes them
+            trees_uneval = gen_tree.iter_semantic_trees(
+                self.archive_tree_deapth, self.problem_data,
+                self.node_constructor, max_num_trees=self.archive_max_trees,
+                num_workers=self.num_archive_workers)
+
+            # add trees_uneval
+            num_added_trees = tree_archive.populate_archive(trees_uneval)
+
+            if self.verbose:
+                print('num trees added to archive : ', num_added_trees)
+
+            tree_archive.gather_tree_outputs()
+
+            tree_archive.save_cache(
+                self.archive_cache_dir, self.problem_data,
+                self.archive_tree_deapth, self.archive_max_trees)
+
+        self.tree_archive = tree_archive
+        return tree_archive
+
+    def get_all_count_wrongs(self):
+        """Returns the errors of every archive tree against the targets."""
+        problem_data = self.problem_data
+
+        if self.boolean_flag:
+            targets_mask = bitarray(len(problem_data.target_outputs))
+            targets_mask.setall(False)
+
+            return self.tree_archive.get_all_count_wrongs(
+                problem_data.target_outputs, targets_mask)
+
+        return self.tree_archive.get_all_count_wrongs(
+            problem_data.target_optimals, None)
+
+    def init_master_tree(self):
+        tree_archive = self.tree_archive
+
+        # pick best (or smallest if equal) tree from archive as master tree
+        best_wrong_count = None
+        best_i_arch_tree = None
+
+        all_count_wrongs = self.get_all_count_wrongs()
+
+        for i_arch_tree, arch_tree in enumerate(tree_archive.archive):
+            wrong_count = all_count_wrongs[i_arch_tree]
+
+            if best_wrong_count == None:
+                best_wrong_count = wrong_count
+                best_i_arch_tree = i_arch_tree
+                continue
+
+            if wrong_count < best_wrong_count:
+                best_wrong_count = wrong_count
+                best_i_arch_tree = i_arch_tree
+                continue
+
+            if (wrong_count == best_wrong_count and arch_tree.tree_size <
+                tree_archive.archive[best_i_arch_tree].tree_size):
+                best_wrong_count = wrong_count
+                best_i_arch_tree = i_arch_tree
+                continue
+
+        master_tree = tree_archive.archive[best_i_arch_tree].tree.copy()
+
+        master_tree.ban_rules.add_rule('', 0, best_i_arch_tree)
+
+        # calculate all statistics for master_tree
+        master_tree.calc_all_outputs()
+        master_tree.calc_all_optimals()
+
+        master_tree.calc_nodes_count_wrongs()
+        master_tree.calc_nodes_count_twos()
+        master_tree.calc_nodes_count_nodes_below()
+
+        return master_tree
+
+    def start(self, master_tree):
+        # pool of threads or processes sharing the archive outputs
+        if self.num_search_threads:
+            self.options_pool = parallel.ThreadOptionsPool(
+                self.tree_archive, self.num_search_threads,
+                self.num_archive_shards)
+
+        elif self.num_archive_shards:
+            self.options_pool = parallel.ArchiveShardPool(
+                self.tree_archive, self.num_option_workers,
+                self.num_archive_shards)
+
+        elif self.num_option_workers:
+            self.options_pool = parallel.NodeOptionsPool(
+                self.tree_archive, self.num_option_workers)
+
+    def step(self, master_tree):
+        # list of nodes which have some wrong outputs
+        wrong_nodes = select.get_with_wrong_nodes(master_tree)
+
+        none = {}
+        worst = {}
+        better = {}
+        perfect = {}
+
+        master_tree.ban_rules.set_master_tree_str(master_tree)
+
+        # find options for all nodes in a single archive pass
+        all_node_data = improve.get_nodes_options_smallest(
+            [i_node for _, _, i_node in wrong_nodes],
+            master_tree, self.tree_archive, self.problem_data,
+            self.options_pool)
+
+        for node_data in all_node_data:
+            i_node = node_data['i_node']
+
+            if node_data['status'] == improve.STATUS_NONE:
+                none[i_node] = node_data
+
+            elif node_data['status'] == improve.STATUS_WORST:
+                worst[i_node] = node_data
+
+            elif node_data['status'] == improve.STATUS_BETTER:
+                better[i_node] = node_data
+
+            elif node_data['status'] == improve.STATUS_PERFECT:
+                perfect[i_node] = node_data
+
+        chosen_archtrees = None
+
+        # check for at least one perfect
+        if perfect:
+            chosen_archtrees = perfect
+            status = 'perfect'
+
+        elif better:
+            chosen_archtrees = better
+            status = 'better'
+
+        elif worst:
+            chosen_archtrees = worst
+            status = 'worst'
+
+        elif none:
+            chosen_archtrees = none
+            status = 'none'
+
+        # find best size reducing arch_tree
+        i_node, arch_tree = select.find_best_smallest_archtree(
+            chosen_archtrees, self.problem_data, self.node_constructor)
+
+        # insert arch_tree into master_tree
+        master_tree = improve.update_master_tree(master_tree, i_node, arch_tree)
+
+        return master_tree, i_node, status
+
+    def close(self):
+        if self.options_pool is not None:
+            self.options_pool.close()
+            self.options_pool = None
+
+# search strategy name : Search class
+STRATEGIES = {
+    'LTI': LTISearch,
+    'GLTI': GLTISearch,
+}
+
+def solve(paramaters, problem_type, strategy):
+    """Runs one search and returns its results_data dict, or None if the
+    archive does not have max_archive_size trees. Raises ValueError if the
+    strategy does not support an optional paramater which is set.
+
+    Arguments:
+    paramaters -- run paramaters dict, benchmark_name, max_archive_size,
+        max_time and verbose are needed by all, num_bits by Boolean
+        problems, the rest depends on the strategy
+    problem_type -- key of PROBLEM_TYPES
+    strategy -- key of STRATEGIES, or a Search subclass.
+    """
+    load_problem, boolean_flag = PROBLEM_TYPES[problem_type]
+    if isinstance(strategy, str):
+        strategy = STRATEGIES[strategy]
+
+    strategy.check_paramaters(paramaters)
+
+    benchmark_name = paramaters['benchmark_name']
+    num_bits = paramaters.get('num_bits')
+
+    max_archive_size = paramaters['max_archive_size']
+    max_time = paramaters['max_time']
+
+    verbose = paramaters['verbose']
+
+    if verbose:
+        if boolean_flag:
+            print(benchmark_name, num_bits)
+        else:
+            print(benchmark_name)
+
+    logbook = utilities.Logbook()
+    logbook.header = [
+        'iteration', 'len_master_tree',
+        'count_wrongs', 'total_wrongs',
+        'picked_node', 'status'
+    ]
+
+    start_time = time.time()
+
+    # generate problem object
+    problem_data, node_constructor = load_problem(paramaters)
+
+    search = strategy(paramaters, problem_data, node_constructor, boolean_flag)
+
+    tree_archive = search.build_archive()
+
+    archive_size = len(tree_archive.archive)
+    if verbose:
+        print('archive_size : ', archive_size)
+
+    if max_archive_size != None:
+        if archive_size != max_archive_size:
+            print('archive_size != max_archive_size')
+            print('archive_size : ', archive_size)
+            print('max_archive_size : ', max_archive_size)
+            return None
+
+    master_tree = search.init_master_tree()
+
+    logbook.record(
+        iteration=0,
+        len_master_tree=len(master_tree),
+        count_wrongs=master_tree[0].wrong_count,
+        total_wrongs=master_tree.total_wrongs,
+        picked_node=None,
+        status=None
+    )
+
+    if verbose:
+        print(logbook.stream)
+
+    solution_found_flag = False
+    current_time = 0
+
+    try:
+        search.start(master_tree)
+
+        for i_iter in range(1, int(1e6)):
+            master_tree, i_node, status = search.step(master_tree)
+
+            logbook.record(
+                iteration=i_iter,
+                len_master_tree=len(master_tree),
+                count_wrongs=master_tree[0].wrong_count,
+                total_wrongs=master_tree.total_wrongs,
+                picked_node=i_node,
+                status=status
+            )
+
+            if i_iter%100 == 0:
+                current_time = time.time() - start_time
+
+                if verbose:
+                    print('current_time : ', current_time)
+
+            if verbose:
+                print(logbook.stream)
+
+            if current_time > max_time:
+                break
+
+            # check for perfect master_tree solution
+            if master_tree[0].wrong_count == 0:
+                solution_found_flag = True
+                break
+
+    finally:
+        search.close()
+
+    end_time = time.time()
+    time_taken = end_time - start_time
+
+    # count nodes which are operators
+    num_op = 0
+    for node in master_tree:
+        if node.type == 'op':
+            num_op += 1
+
+    results_data = {
+        'tree_str': str(master_tree),
+        'tree_len': len(master_tree),
+
+        'number_of_operators': num_op,
+        'time_taken': time_taken,
+        'solution_found_flag': solution_found_flag,
+
+        'logbook': logbook,
+
+        'max_archive_size': max_archive_size,
+        'archive_size': archive_size,
+        'archive_tree_deapth': search.archive_tree_deapth,
+
+        'num_bits': num_bits,
+        'benchmark_name': benchmark_name,
+        'alg_name': search.alg_name,
+    }
+
+    if verbose:
+        print(logbook.stream)
+        print('time_taken : ', time_taken)
+        print('solution_found_flag : ', solution_found_flag)
+        print('tree_len : ', len(master_tree))
+        print('number_of_operators : ', num_op)
+
+    return results_data
+
+def json_default(obj):
+    """json default for the numpy values and sets in results_data."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+
+    return str(obj)
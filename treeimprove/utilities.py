@@ -242,6 +242,8 @@ def disp_tree(tree):
 
     g.vs['label'] = [node.name for node in tree]
 
+    i_nodes = tree.get_node_indexes()
+
     nodes_to_add = set([0])
     while len(nodes_to_add) != 0:
 
@@ -253,12 +255,12 @@ def disp_tree(tree):
         right_node = node.right_child
 
         if left_node != None:
-            i_left = tree.index(left_node)
+            i_left = i_nodes[id(left_node)]
             g.add_edges((i_node, i_left))
             nodes_to_add.add(i_left)
         
         if right_node != None:
-            i_right = tree.index(right_node)
+            i_right = i_nodes[id(right_node)]
             g.add_edges((i_node, i_right))
             nodes_to_add.add(i_right)
 